@@ -0,0 +1,574 @@
+"""
+Simulate many players pressing buttons at once, against a throwaway database
+on a local Postgres, while the production loop runs alongside them.
+
+    FARMER_BENCHMARK_DSN=postgresql://postgres@localhost/postgres \\
+        python -m benchmarks.load [--players 1000] [--duration 60]
+
+The database is filled the same way as the production benchmark. Each
+simulated player then repeatedly picks one of the plugins' interaction
+handlers, calls it with a fake interaction, and waits for a random think
+time. The handlers use the database through ``Database.acquire`` as they
+do in the bot, which is pointed at a pool that times how long each
+connection takes to get. Production ticks run in whichever mode
+``FARMER_PRODUCTION_MODE`` sets, on the same pool, and resident tables
+are flushed as often as the bot flushes them. A handler that raises or
+doesn't respond counts as an error, and any errors make the run fail.
+
+The report has each handler's latency percentiles and throughput, latency
+while a tick was running, the pool's wait times, and how long each tick
+took.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import traceback
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import asyncpg
+import numpy as np
+from novus.ext import database as db
+
+import utils
+from plugins.items import BASE_SELL_PRICE, Items
+from plugins.plots import Plots
+from plugins.user import User
+
+from .production import load, load_animal_table, throwaway_database
+
+
+DATABASE_NAME = "farmer_benchmark_load"
+STARTING_MONEY = 10 ** 12  # Enough that animals can always be bought
+STARTING_ITEM_TYPES = 3
+
+# Each action is a coroutine function taking the plugins, the player and the
+# player's random generator, and returning the interaction that it used,
+# weighted by roughly how often it's used
+ACTIONS: dict[str, tuple[float, Callable[..., Awaitable[FakeInteraction]]]] = {}
+
+
+def action(name: str, weight: float):
+    """
+    Register an action that a simulated player can take.
+    """
+
+    def decorator(func: Callable[..., Awaitable[FakeInteraction]]):
+        ACTIONS[name] = (weight, func)
+        return func
+    return decorator
+
+
+class FakeGuild:
+
+    def __init__(self, id: int):
+        self.id = id
+
+
+class FakeUser:
+
+    def __init__(self, id: int):
+        self.id = id
+        self.name = self.username = self.global_name = f"player{id}"
+        self.display_name = self.name
+        self.mention = f"<@{id}>"
+        self.avatar = None
+        self.bot = False
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeComponentData:
+
+    def __init__(self, custom_id: str):
+        self.custom_id = custom_id
+
+
+class FakeInteraction:
+    """
+    Enough of an interaction for the plugins' handlers to run against.
+    Responses aren't sent anywhere; they're kept in ``responses``.
+    """
+
+    def __init__(self, guild_id: int, user_id: int, custom_id: str | None = None):
+        self.guild = FakeGuild(guild_id)
+        self.user = FakeUser(user_id)
+        self.locale = "en-US"
+        self.custom_id = custom_id
+        self.data = FakeComponentData(custom_id) if custom_id else None
+        self.responses: list[tuple[str, tuple, dict[str, Any]]] = []
+
+    def _(self, text: str) -> str:
+        return text
+
+    async def send(self, *args, **kwargs) -> None:
+        self.responses.append(("send", args, kwargs))
+
+    async def update(self, *args, **kwargs) -> None:
+        self.responses.append(("update", args, kwargs))
+
+    async def defer(self, *args, **kwargs) -> None:
+        self.responses.append(("defer", args, kwargs))
+
+
+class Player:
+    """
+    A simulated user in a guild.
+
+    Attributes
+    ----------
+    guild_id : int
+        The guild that the player is in.
+    user_id : int
+        The player's user ID.
+    positions : list[tuple[int, int]]
+        The positions of the plots that the player owns.
+    items : list[utils.AnimalType]
+        The items that the player was given to start with.
+    """
+
+    def __init__(
+            self,
+            guild_id: int,
+            user_id: int,
+            positions: list[tuple[int, int]],
+            items: list[utils.AnimalType]):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.positions = positions
+        self.items = items
+
+    def interaction(self, custom_id: str | None = None) -> FakeInteraction:
+        return FakeInteraction(self.guild_id, self.user_id, custom_id)
+
+    def plot_button(self, prefix: str, r: random.Random) -> FakeInteraction:
+        x, y = r.choice(self.positions)
+        return self.interaction(f"{prefix} {self.user_id} {x} {y}")
+
+
+class Plugins:
+    """
+    The plugins whose handlers are being driven. The handlers don't use the
+    bot, so the plugins are made without one.
+    """
+
+    def __init__(self):
+        self.plots = Plots.__new__(Plots)
+        self.items = Items.__new__(Items)
+        self.user = User.__new__(User)
+
+
+@action("show_plot", 20)
+async def show_plot(plugins: Plugins, player: Player, r: random.Random):
+    ctx = player.interaction()
+    await plugins.plots.show_plot(ctx)
+    return ctx
+
+
+@action("plot_show_button_pressed", 30)
+async def plot_show_button_pressed(plugins: Plugins, player: Player, r: random.Random):
+    ctx = player.plot_button("PLOT_SHOW", r)
+    await plugins.plots.plot_show_button_pressed(ctx)
+    return ctx
+
+
+@action("plot_move_items_button_pressed", 15)
+async def plot_move_items_button_pressed(plugins: Plugins, player: Player, r: random.Random):
+    ctx = player.plot_button("PLOT_MOVE_ITEMS", r)
+    await plugins.plots.plot_move_items_button_pressed(ctx)
+    return ctx
+
+
+@action("buy_animal_button_pressed", 2)
+async def buy_animal_button_pressed(plugins: Plugins, player: Player, r: random.Random):
+    ctx = player.plot_button("PLOT_BUY_ANIMAL", r)
+    await plugins.plots.buy_animal_button_pressed(ctx)
+    return ctx
+
+
+@action("sell", 10)
+async def sell(plugins: Plugins, player: Player, r: random.Random):
+    item = r.choice(player.items)
+    ctx = player.interaction()
+    await plugins.items.sell(ctx, item.name, r.choice([-1, 1, 5]))
+    return ctx
+
+
+@action("sell_button_pressed", 8)
+async def sell_button_pressed(plugins: Plugins, player: Player, r: random.Random):
+    item = r.choice(player.items)
+    ctx = player.interaction(f"SELL {item.name} {r.randint(1, 5)} {BASE_SELL_PRICE}")
+    await plugins.items.sell_button_pressed(ctx)
+    return ctx
+
+
+@action("inventory", 15)
+async def inventory(plugins: Plugins, player: Player, r: random.Random):
+    ctx = player.interaction()
+    await plugins.user.inventory(ctx)
+    return ctx
+
+
+class TimedPool:
+    """
+    Wraps a pool to record how long each ``acquire`` waits for a
+    connection.
+    """
+
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+        self.waits: list[float] = []
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        start = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            self.waits.append(time.perf_counter() - start)
+            yield conn
+
+
+class Recorder:
+    """
+    Collects the timings from a run.
+    """
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {name: [] for name in ACTIONS}
+        self.tick_latencies: dict[str, list[float]] = {name: [] for name in ACTIONS}
+        self.errors: dict[str, int] = {name: 0 for name in ACTIONS}
+        self.first_errors: dict[str, str] = {}
+        self.ticks: list[dict[str, Any]] = []
+        self.flushes: list[float] = []
+        self.ticking = False
+
+    async def run(self, name: str, coro: Awaitable[FakeInteraction]) -> None:
+        during_tick = self.ticking
+        start = time.perf_counter()
+        try:
+            ctx = await coro
+
+            # Handlers that fail without raising still shouldn't be timed
+            if not ctx.responses:
+                raise RuntimeError("The handler didn't respond")
+        except Exception:
+            self.errors[name] += 1
+            self.first_errors.setdefault(name, traceback.format_exc())
+            return
+        latency = time.perf_counter() - start
+        self.latencies[name].append(latency)
+        if during_tick or self.ticking:
+            self.tick_latencies[name].append(latency)
+
+
+async def seed_players(
+        conn: asyncpg.Connection,
+        count: int,
+        r: random.Random) -> list[Player]:
+    """
+    Pick the plot owners to play as, giving them money and items and
+    filling in the counters that the load doesn't.
+    """
+
+    await utils.check_animal_counts(conn, repair=True)
+    await utils.check_animal_census(conn, repair=True)
+    rows = await conn.fetch(
+        """
+        SELECT
+            guild_id,
+            owner_id,
+            ARRAY_AGG(x ORDER BY x) AS xs,
+            ARRAY_AGG(y ORDER BY x) AS ys
+        FROM
+            plots
+        GROUP BY
+            guild_id,
+            owner_id
+        """
+    )
+    rows = r.sample(rows, min(count, len(rows)))
+    players = [
+        Player(
+            row["guild_id"],
+            row["owner_id"],
+            list(zip(row["xs"], row["ys"])),
+            r.sample(list(utils.AnimalType), STARTING_ITEM_TYPES),
+        )
+        for row in rows
+    ]
+    await conn.executemany(
+        """
+        INSERT INTO
+            inventory
+            (
+                owner_id,
+                guild_id,
+                money
+            )
+        VALUES
+            (
+                $1,
+                $2,
+                $3
+            )
+        ON CONFLICT (owner_id, guild_id)
+        DO UPDATE
+        SET
+            money = excluded.money
+        """,
+        [(p.user_id, p.guild_id, STARTING_MONEY) for p in players],
+    )
+    await conn.copy_records_to_table(
+        "user_items",
+        records=(
+            (p.user_id, p.guild_id, item.code, r.randint(1, 200))
+            for p in players
+            for item in p.items
+        ),
+        columns=["owner_id", "guild_id", "item", "amount"],
+    )
+    await conn.execute("ANALYZE")
+    return players
+
+
+async def play(
+        plugins: Plugins,
+        player: Player,
+        recorder: Recorder,
+        deadline: float,
+        think_time: float,
+        seed: int) -> None:
+    r = random.Random(seed)
+    names = list(ACTIONS)
+    weights = [ACTIONS[i][0] for i in names]
+
+    # Spread the first presses out so that everyone doesn't start at once
+    await asyncio.sleep(r.uniform(0, think_time))
+    while time.perf_counter() < deadline:
+        name, = r.choices(names, weights)
+        await recorder.run(name, ACTIONS[name][1](plugins, player, r))
+        await asyncio.sleep(min(r.expovariate(1 / think_time), max(deadline - time.perf_counter(), 0)))
+
+
+async def produce(
+        pool: TimedPool,
+        recorder: Recorder,
+        deadline: float,
+        args: argparse.Namespace) -> None:
+    """
+    Run production ticks every ``--tick-interval`` seconds until the deadline.
+    """
+
+    r = random.Random(args.seed)
+    while time.perf_counter() < deadline:
+        random_key = r.random()
+        recorder.ticking = True
+        start = time.perf_counter()
+        try:
+            shards = await utils.run_production_tick(
+                pool.acquire,
+                random_key,
+                shards=args.shards,
+                concurrency=args.concurrency,
+            )
+        finally:
+            recorder.ticking = False
+        wall = time.perf_counter() - start
+        result = utils.ProductionResult.total(shards)
+        recorder.ticks.append({
+            "random_key": random_key,
+            "wall_s": wall,
+            "rows": result.rows,
+            "items": result.items,
+        })
+        await asyncio.sleep(max(min(args.tick_interval - wall, deadline - time.perf_counter()), 0))
+
+
+async def flush(
+        pool: TimedPool,
+        recorder: Recorder,
+        deadline: float,
+        args: argparse.Namespace) -> None:
+    """
+    Flush the resident animal table every ``--flush-interval`` seconds until
+    the deadline, as the plots plugin does.
+    """
+
+    while True:
+        await asyncio.sleep(max(min(args.flush_interval, deadline - time.perf_counter()), 0))
+        if time.perf_counter() >= deadline:
+            return
+        if utils.AnimalTable.current is None:
+            continue
+        start = time.perf_counter()
+        async with pool.acquire() as conn:
+            await utils.AnimalTable.current.flush(conn)
+        recorder.flushes.append(time.perf_counter() - start)
+
+
+def get_percentiles(values: list[float]) -> dict[str, float | None]:
+    if not values:
+        return {"p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]) * 1000
+    return {
+        "p50_ms": float(p50),
+        "p90_ms": float(p90),
+        "p99_ms": float(p99),
+        "max_ms": max(values) * 1000,
+    }
+
+
+def summarise(
+        recorder: Recorder,
+        pool: TimedPool,
+        players: int,
+        duration: float,
+        args: argparse.Namespace) -> dict[str, Any]:
+    handlers = {}
+    for name in ACTIONS:
+        latencies = recorder.latencies[name]
+        handlers[name] = {
+            "count": len(latencies),
+            "errors": recorder.errors[name],
+            "per_second": len(latencies) / duration,
+            **get_percentiles(latencies),
+            "during_tick": get_percentiles(recorder.tick_latencies[name]),
+        }
+    total = sum(len(i) for i in recorder.latencies.values())
+    return {
+        "production_mode": utils.PRODUCTION_MODE.value,
+        "players": players,
+        "pool_size": args.pool_size,
+        "duration_s": duration,
+        "interactions": total,
+        "per_second": total / duration,
+        "handlers": handlers,
+        "pool_wait": {"count": len(pool.waits), **get_percentiles(pool.waits)},
+        "ticks": recorder.ticks,
+        "flushes_s": recorder.flushes,
+    }
+
+
+def format_ms(value: float | None) -> str:
+    return "-" if value is None else f"{value:,.1f}"
+
+
+def print_summary(summary: dict[str, Any]) -> None:
+    print(
+        f"{'handler':<32}{'count':>8}{'errors':>8}{'/s':>8}"
+        f"{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'tick p99':>10}"
+    )
+    for name, h in summary["handlers"].items():
+        print(
+            f"{name:<32}{h['count']:>8,}{h['errors']:>8,}{h['per_second']:>8.1f}"
+            f"{format_ms(h['p50_ms']):>9}{format_ms(h['p90_ms']):>9}"
+            f"{format_ms(h['p99_ms']):>9}{format_ms(h['max_ms']):>9}"
+            f"{format_ms(h['during_tick']['p99_ms']):>10}"
+        )
+    print(
+        f"{summary['interactions']:,} interactions from {summary['players']:,} players "
+        f"in {summary['duration_s']:.1f}s ({summary['per_second']:,.1f}/s)"
+    )
+    wait = summary["pool_wait"]
+    print(
+        f"Pool of {summary['pool_size']}: {wait['count']:,} acquires, waits "
+        f"p50 {format_ms(wait['p50_ms'])}ms, p99 {format_ms(wait['p99_ms'])}ms, "
+        f"max {format_ms(wait['max_ms'])}ms"
+    )
+    ticks = summary["ticks"]
+    if ticks:
+        walls = [i["wall_s"] for i in ticks]
+        print(
+            f"{len(ticks)} {summary['production_mode']} ticks: median "
+            f"{float(np.median(walls)):.2f}s, slowest {max(walls):.2f}s"
+        )
+    flushes = summary["flushes_s"]
+    if flushes:
+        print(
+            f"{len(flushes)} flushes: median {float(np.median(flushes)):.2f}s, "
+            f"slowest {max(flushes):.2f}s"
+        )
+
+
+async def run(dsn: str, args: argparse.Namespace) -> dict[str, Any]:
+    async with throwaway_database(dsn, DATABASE_NAME, args.keep) as conn:
+        await load(conn, args.animals, args.seed)
+        players = await seed_players(conn, args.players, random.Random(args.seed))
+        await load_animal_table(conn, utils.PRODUCTION_MODE)
+
+        pool = TimedPool(await asyncpg.create_pool(
+            dsn,
+            database=DATABASE_NAME,
+            min_size=args.pool_size,
+            max_size=args.pool_size,
+            init=utils.STATEMENTS.setup,
+        ))
+        acquire = db.Database.acquire
+        db.Database.acquire = pool.acquire
+        try:
+            await utils.INVENTORY_CACHE.listen(pool.acquire)
+            pool.waits.clear()
+
+            plugins = Plugins()
+            recorder = Recorder()
+            start = time.perf_counter()
+            deadline = start + args.duration
+            tasks = [
+                play(plugins, player, recorder, deadline, args.think_time, args.seed + i)
+                for i, player in enumerate(players)
+            ]
+            if utils.PRODUCTION_MODE != utils.ProductionMode.LAZY:
+                tasks.append(produce(pool, recorder, deadline, args))
+                tasks.append(flush(pool, recorder, deadline, args))
+            await asyncio.gather(*tasks)
+            duration = time.perf_counter() - start
+        finally:
+            db.Database.acquire = acquire
+            await utils.INVENTORY_CACHE.close()
+            utils.AnimalTable.current = None
+            await pool.pool.close()
+
+    for name, error in recorder.first_errors.items():
+        print(f"First error from {name}:\n{error}", file=sys.stderr)
+    return summarise(recorder, pool, len(players), duration, args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--animals", type=int, default=100_000, help="How many animals to load.")
+    parser.add_argument("--players", type=int, default=1_000)
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run for.")
+    parser.add_argument("--think-time", type=float, default=2, help="Mean seconds between each player's presses.")
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--tick-interval", type=float, default=utils.PRODUCTION_TICK_INTERVAL)
+    parser.add_argument("--flush-interval", type=float, default=utils.PRODUCTION_FLUSH_INTERVAL)
+    parser.add_argument("--shards", type=int, default=utils.PRODUCTION_SHARDS)
+    parser.add_argument("--concurrency", type=int, default=utils.PRODUCTION_CONCURRENCY)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file.")
+    parser.add_argument("--keep", action="store_true", help="Don't drop the database afterwards.")
+    args = parser.parse_args()
+
+    dsn = os.getenv("FARMER_BENCHMARK_DSN")
+    if not dsn:
+        sys.exit("FARMER_BENCHMARK_DSN needs to be set to a local Postgres")
+
+    summary = asyncio.run(run(dsn, args))
+    print_summary(summary)
+    errors = sum(h["errors"] for h in summary["handlers"].values())
+    if errors:
+        sys.exit(f"{errors:,} interactions failed")
+    if args.output:
+        args.output.write_text(json.dumps(summary, indent=4) + "\n")
+
+
+if __name__ == "__main__":
+    main()
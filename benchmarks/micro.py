@@ -0,0 +1,314 @@
+"""
+Time the pure-Python work done on each interaction, and compare it against a
+stored baseline so that regressions show up before a release.
+
+    python -m benchmarks.micro [--output results.json] [--save-baseline]
+
+Functions that are cached between interactions are timed twice: once as
+they usually run, and once marked "cold" with their caches cleared before
+every call. Nothing here touches the network or the database. The command
+exits with a non-zero status if anything is slower than the baseline by
+more than ``--tolerance``. Baselines are only comparable on the same machine and
+Python version, so record one with ``--save-baseline`` where releases are
+checked.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable
+
+import utils
+
+
+BASELINE_PATH = Path(__file__).with_name("micro_baseline.json")
+MIN_RUN_TIME = 0.05  # Seconds that each timed run is calibrated to take
+
+BENCHMARKS: dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark. The decorated function does any setup and returns
+    the function to be timed.
+    """
+
+    def decorator(func: Callable[[], Callable[[], Any]]):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def make_animal_row(r: random.Random, plot_id: uuid.UUID) -> dict[str, Any]:
+    return {
+        "id": uuid.UUID(int=r.getrandbits(128)),
+        "type": r.choice(list(utils.AnimalType)).code,
+        "plot_id": plot_id,
+        "production_rate": r.random(),
+    }
+
+
+def make_plot_row(r: random.Random, x: int, y: int) -> dict[str, Any]:
+    return {
+        "id": uuid.UUID(int=r.getrandbits(128)),
+        "owner_id": 1_000_000_000_000_000,
+        "guild_id": 2_000_000_000_000_000,
+        "x": x,
+        "y": y,
+        "type": r.choice(list(utils.PlotType)).code,
+    }
+
+
+def make_plots(r: random.Random, count: int) -> list[utils.Plot]:
+    return [
+        utils.Plot.from_row(make_plot_row(r, i % 5, i // 5))
+        for i in range(count)
+    ]
+
+
+@benchmark("Animal.from_row")
+def animal_from_row():
+    r = random.Random(0)
+    row = make_animal_row(r, uuid.UUID(int=1))
+    return lambda: utils.Animal.from_row(row)
+
+
+@benchmark("Plot.from_row")
+def plot_from_row():
+    r = random.Random(0)
+    row = make_plot_row(r, 2, 3)
+    return lambda: utils.Plot.from_row(row)
+
+
+@benchmark("PlotItems.from_rows")
+def plot_items_from_rows():
+    r = random.Random(0)
+    plot_id = uuid.UUID(int=1)
+    rows = [
+        {"plot_id": plot_id, "item": t.code, "amount": r.randint(1, 20)}
+        for t in r.sample(list(utils.AnimalType), 5)
+    ]
+    return lambda: utils.PlotItems.from_rows(rows)
+
+
+@benchmark("Item.__str__")
+def item_str():
+    item = utils.Item(utils.AnimalType.SHEEP, 1_234)
+    return lambda: str(item)
+
+
+@benchmark("PlotWithAnimals.__str__")
+def plot_with_animals_str():
+    r = random.Random(0)
+    plot, = make_plots(r, 1)
+    animals = [
+        utils.Animal.from_row(make_animal_row(r, plot.id))
+        for _ in range(10)
+    ]
+    plot = utils.PlotWithAnimals(
+        id=plot.id,
+        guild_id=plot.guild_id,
+        owner_id=plot.owner_id,
+        position=plot.position,
+        type=plot.type,
+        animals=animals,
+    )
+    return lambda: str(plot)
+
+
+@benchmark("Plots.get_user_plots")
+def get_user_plots():
+    from plugins.plots import Plots
+
+    plots = make_plots(random.Random(0), 9)
+    return lambda: Plots.get_user_plots(plots[0].guild_id, plots[0].owner_id, plots)
+
+
+@benchmark("Plots.get_user_plots (cold)")
+def get_user_plots_cold():
+    from plugins.plots import Plots, get_plot_layout
+
+    plots = make_plots(random.Random(0), 9)
+
+    def run():
+        get_plot_layout.cache_clear()
+        return Plots.get_user_plots(plots[0].guild_id, plots[0].owner_id, plots)
+    return run
+
+
+@benchmark("Plots.get_plot_buttons")
+def get_plot_buttons():
+    from plugins.plots import PlotButtonMode, Plots
+
+    plots = make_plots(random.Random(0), 9)
+    return lambda: Plots.get_plot_buttons(
+        plots[0].guild_id,
+        plots[0].owner_id,
+        plots,
+        PlotButtonMode.SHOW,
+    )
+
+
+@benchmark("Plots.get_plot_buttons (cold)")
+def get_plot_buttons_cold():
+    from plugins.plots import PlotButtonMode, Plots, build_plot_buttons, get_plot_layout
+
+    plots = make_plots(random.Random(0), 9)
+
+    def run():
+        get_plot_layout.cache_clear()
+        build_plot_buttons.cache_clear()
+        return Plots.get_plot_buttons(
+            plots[0].guild_id,
+            plots[0].owner_id,
+            plots,
+            PlotButtonMode.SHOW,
+        )
+    return run
+
+
+@benchmark("get_sell_choices")
+def sell_choices():
+    from plugins.items import get_sell_choices
+
+    r = random.Random(0)
+    items = utils.UserItems(1, 2, [
+        utils.Item(t, r.randint(1, 100))
+        for t in r.sample(list(utils.AnimalType), 15)
+    ])
+    queries = ["", "m", "mi", "mil", "milk", "w", "wo", "woo", "wool"]
+    index = 0
+
+    def run():
+        nonlocal index
+        index = (index + 1) % len(queries)
+        return get_sell_choices(items, queries[index])
+    return run
+
+
+@benchmark("get_sell_choices (cold)")
+def sell_choices_cold():
+    from plugins.items import get_sell_choices
+
+    r = random.Random(0)
+    items = utils.UserItems(1, 2, [
+        utils.Item(t, r.randint(1, 100))
+        for t in r.sample(list(utils.AnimalType), 15)
+    ])
+    queries = ["", "m", "mi", "mil", "milk", "w", "wo", "woo", "wool"]
+    index = 0
+
+    def run():
+        nonlocal index
+        index = (index + 1) % len(queries)
+        utils.ITEM_SEARCH.search.cache_clear()
+        return get_sell_choices(items, queries[index])
+    return run
+
+
+def measure(func: Callable[[], Any], repeat: int) -> dict[str, float]:
+    """
+    Time a function, returning the fastest and median nanoseconds per call
+    over ``repeat`` runs.
+    """
+
+    number = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= MIN_RUN_TIME * 1e9:
+            break
+        number *= 2
+
+    runs = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        runs.append((time.perf_counter_ns() - start) / number)
+    return {
+        "min_ns": min(runs),
+        "median_ns": statistics.median(runs),
+        "calls": number,
+    }
+
+
+def run(names: list[str], repeat: int) -> dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "results": {
+            name: measure(BENCHMARKS[name](), repeat)
+            for name in names
+        },
+    }
+
+
+def compare(
+        current: dict[str, Any],
+        baseline: dict[str, Any],
+        tolerance: float) -> list[str]:
+    """
+    Print each result against the baseline, returning the names of the
+    benchmarks that have regressed.
+    """
+
+    regressions = []
+    print(f"{'benchmark':<32}{'ns/call':>12}{'baseline':>12}{'change':>10}")
+    for name, result in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            print(f"{name:<32}{result['min_ns']:>12,.0f}{'-':>12}{'new':>10}")
+            continue
+        change = result["min_ns"] / old["min_ns"] - 1
+        flag = ""
+        if change > tolerance:
+            regressions.append(name)
+            flag = " !"
+        print(
+            f"{name:<32}{result['min_ns']:>12,.0f}{old['min_ns']:>12,.0f}"
+            f"{change:>+10.1%}{flag}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before failing, as a fraction.")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this.")
+    args = parser.parse_args()
+
+    names = [i for i in BENCHMARKS if args.filter in i]
+    current = run(names, args.repeat)
+    if args.output:
+        args.output.write_text(json.dumps(current, indent=4) + "\n")
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(current, indent=4) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+
+    baseline = {}
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text())
+    regressions = compare(current, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} benchmarks regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
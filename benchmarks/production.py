@@ -0,0 +1,390 @@
+"""
+Measure how production ticks scale with the number of animals, against
+throwaway databases on a local Postgres.
+
+    FARMER_BENCHMARK_DSN=postgresql://postgres@localhost/postgres \\
+        python -m benchmarks.production [--sizes 10000,100000,1000000,5000000]
+
+For each size a new database is created through the DSN, filled with
+synthetic guilds, plots, animals and plot items using COPY, ticked a few
+times in the given production mode, and dropped. Each tick reports its
+wall time, the rows and items written, this process's peak RSS, and the
+time that Postgres spent running queries for it. Resident tables are
+flushed as often as the bot flushes them, and that's reported separately.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Iterator
+
+import asyncpg
+import numpy as np
+
+import utils
+
+
+SCHEMA_PATH = Path(__file__).parent.parent / "database.pgsql"
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000, 5_000_000)
+PLOTS_PER_USER = 5
+USERS_PER_GUILD = 500
+FULL_PLOT_SHARE = 0.1  # Plots that start at capacity, so they're skipped
+COPY_BATCH_SIZE = 100_000
+PLOT_ID_MULTIPLIER = 0x9E3779B97F4A7C15F39CC0605CEDC835  # Odd, so IDs are unique
+
+
+def reset_peak_rss() -> None:
+    """
+    Reset this process's peak RSS, where the OS allows it.
+    """
+
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss() -> int:
+    """
+    Get this process's peak RSS in bytes since it was last reset.
+    """
+
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_plot_id(plot: int) -> uuid.UUID:
+    # Spread across the ID space like random IDs, as production shards are
+    # ranges of plot IDs
+    return uuid.UUID(int=(plot + 1) * PLOT_ID_MULTIPLIER % 2 ** 128)
+
+
+def generate_plots(plot_count: int, rng: np.random.Generator) -> Iterator[tuple]:
+    types = rng.integers(1, len(utils.PlotType) + 1, plot_count)
+    for plot in range(plot_count):
+        user = plot // PLOTS_PER_USER
+        yield (
+            get_plot_id(plot),
+            user + 1,
+            user // USERS_PER_GUILD + 1,
+            plot % PLOTS_PER_USER,
+            0,
+            int(types[plot]),
+        )
+
+
+def generate_animals(
+        plots: np.ndarray,
+        rng: np.random.Generator) -> Iterator[tuple]:
+    for start in range(0, len(plots), COPY_BATCH_SIZE):
+        batch = plots[start:start + COPY_BATCH_SIZE]
+        types = rng.integers(1, len(utils.AnimalType) + 1, len(batch))
+        rates = np.clip(rng.normal(0.5, 0.115, len(batch)), 0.1, 0.9)
+        yield from zip(
+            map(get_plot_id, batch.tolist()),
+            types.tolist(),
+            rates.tolist(),
+        )
+
+
+def generate_plot_items(plot_count: int, rng: np.random.Generator) -> Iterator[tuple]:
+    kinds = rng.random(plot_count)
+    items = rng.integers(1, len(utils.AnimalType) + 1, plot_count)
+    amounts = rng.integers(1, 80, plot_count)
+    for plot in range(plot_count):
+        if kinds[plot] < FULL_PLOT_SHARE:
+            yield get_plot_id(plot), int(items[plot]), utils.PLOT_ITEM_CAPACITY
+        elif kinds[plot] < 0.5:
+            yield get_plot_id(plot), int(items[plot]), int(amounts[plot])
+
+
+async def load(conn: asyncpg.Connection, size: int, seed: int) -> dict[str, Any]:
+    """
+    Fill an empty database with ``size`` animals, returning how many plots
+    there are and how long the load took.
+    """
+
+    start = time.perf_counter()
+    await conn.execute(SCHEMA_PATH.read_text())
+    rng = np.random.default_rng(seed)
+
+    # Between 1 and 10 animals a plot, as in the README
+    counts = rng.integers(1, 11, size // 5 + 1)
+    counts = counts[:int(np.searchsorted(np.cumsum(counts), size)) + 1]
+    plots = np.repeat(np.arange(len(counts)), counts)[:size]
+
+    await conn.copy_records_to_table(
+        "plots",
+        records=generate_plots(len(counts), rng),
+        columns=["id", "owner_id", "guild_id", "x", "y", "type"],
+    )
+    await conn.copy_records_to_table(
+        "animals",
+        records=generate_animals(plots, rng),
+        columns=["plot_id", "type", "production_rate"],
+    )
+    await conn.copy_records_to_table(
+        "plot_items",
+        records=generate_plot_items(len(counts), rng),
+        columns=["plot_id", "item", "amount"],
+    )
+    await conn.execute(
+        """
+        UPDATE
+            plots
+        SET
+            item_count = plot_items.amount
+        FROM
+            plot_items
+        WHERE
+            plots.id = plot_items.plot_id
+        """
+    )
+    await conn.execute("VACUUM ANALYZE")
+    return {
+        "plots": len(counts),
+        "load_s": time.perf_counter() - start,
+    }
+
+
+async def get_active_time(conn: asyncpg.Connection, before: float | None = None) -> float | None:
+    """
+    Get the milliseconds that the current database has spent running
+    queries, waiting for backends that have just disconnected to report
+    theirs if ``before`` is given. This needs Postgres 14 or newer.
+    """
+
+    deadline = time.monotonic() + 2
+    while True:
+        await conn.execute("SELECT PG_STAT_CLEAR_SNAPSHOT()")
+        try:
+            active = await conn.fetchval(
+                """
+                SELECT
+                    active_time
+                FROM
+                    pg_stat_database
+                WHERE
+                    datname = CURRENT_DATABASE()
+                """
+            )
+        except asyncpg.UndefinedColumnError:
+            return None
+        if before is None or active != before or time.monotonic() > deadline:
+            return active
+        await asyncio.sleep(0.05)
+
+
+@contextlib.asynccontextmanager
+async def throwaway_database(dsn: str, database: str, keep: bool = False):
+    """
+    Create an empty database through a DSN, yielding a connection to it,
+    and drop it afterwards unless ``keep`` is set.
+    """
+
+    admin = await asyncpg.connect(dsn)
+    try:
+        await admin.execute(f"DROP DATABASE IF EXISTS {database} WITH (FORCE)")
+        await admin.execute(f"CREATE DATABASE {database}")
+        conn = await asyncpg.connect(dsn, database=database)
+        try:
+            yield conn
+        finally:
+            await conn.close()
+    finally:
+        if not keep:
+            await admin.execute(f"DROP DATABASE IF EXISTS {database} WITH (FORCE)")
+        await admin.close()
+
+
+async def load_animal_table(conn: asyncpg.Connection, mode: utils.ProductionMode) -> None:
+    """
+    Load the resident animal table if this production mode uses one, as
+    the plots plugin does.
+    """
+
+    table_type = {
+        utils.ProductionMode.RESIDENT: utils.AnimalTable,
+        utils.ProductionMode.SCHEDULED: utils.ScheduledAnimalTable,
+    }.get(mode)
+    utils.AnimalTable.current = None
+    if table_type is not None:
+        utils.AnimalTable.current = await table_type.load(conn)
+
+
+async def run_tick(
+        dsn: str,
+        database: str,
+        tick: int,
+        random_key: float,
+        args: argparse.Namespace) -> utils.ProductionResult:
+    """
+    Run a single tick on a pool that's closed afterwards, so that its time
+    is reported to ``pg_stat_database``. Scheduled tables are moved on by a
+    whole tick interval each time, so that they have something to do.
+    """
+
+    pool = await asyncpg.create_pool(
+        dsn,
+        database=database,
+        min_size=1,
+        max_size=max(args.concurrency, 1),
+    )
+    try:
+        shards = await utils.run_production_tick(
+            pool.acquire,
+            random_key,
+            now=time.time() + (tick + 1) * utils.PRODUCTION_TICK_INTERVAL,
+            shards=args.shards,
+            concurrency=args.concurrency,
+        )
+        return utils.ProductionResult.total(shards)
+    finally:
+        await pool.close()
+
+
+async def run_size(dsn: str, size: int, args: argparse.Namespace) -> dict[str, Any]:
+    database = f"farmer_benchmark_{size}"
+    async with throwaway_database(dsn, database, args.keep) as conn:
+        summary: dict[str, Any] = {"animals": size, **await load(conn, size, args.seed)}
+
+        # Resident modes load every animal into memory once
+        mode = utils.ProductionMode(args.mode)
+        if mode in (utils.ProductionMode.RESIDENT, utils.ProductionMode.SCHEDULED):
+            reset_peak_rss()
+            start = time.perf_counter()
+            await load_animal_table(conn, mode)
+            summary["table_load_s"] = time.perf_counter() - start
+            summary["table_peak_rss"] = get_peak_rss()
+
+        # Resident tables are flushed as often as the plots plugin does it,
+        # and after the last tick, which is timed on its own rather than as
+        # part of a tick
+        flush_every = max(utils.PRODUCTION_FLUSH_INTERVAL // utils.PRODUCTION_TICK_INTERVAL, 1)
+        rng = np.random.default_rng(args.seed)
+        ticks = []
+        try:
+            for tick in range(args.ticks):
+                random_key = float(rng.random())
+                before = await get_active_time(conn)
+                reset_peak_rss()
+                start = time.perf_counter()
+                result = await run_tick(dsn, database, tick, random_key, args)
+                wall = time.perf_counter() - start
+                peak_rss = get_peak_rss()
+                after = await get_active_time(conn, before)
+                flush = None
+                table = utils.AnimalTable.current
+                if table is not None and ((tick + 1) % flush_every == 0 or tick + 1 == args.ticks):
+                    start = time.perf_counter()
+                    await table.flush(conn)
+                    flush = time.perf_counter() - start
+                ticks.append({
+                    "random_key": random_key,
+                    "wall_s": wall,
+                    "rows": result.rows,
+                    "items": result.items,
+                    "peak_rss": peak_rss,
+                    "db_ms": None if before is None or after is None else after - before,
+                    "flush_s": flush,
+                })
+        finally:
+            utils.AnimalTable.current = None
+        summary["ticks"] = ticks
+    return summary
+
+
+def print_summary(summary: dict[str, Any]) -> None:
+    ticks = summary["ticks"]
+    wall = statistics.median(t["wall_s"] for t in ticks)
+    db_times = [t["db_ms"] for t in ticks if t["db_ms"] is not None]
+    db_ms = f"{statistics.median(db_times):,.0f}" if db_times else "-"
+    flushes = [t["flush_s"] for t in ticks if t["flush_s"] is not None]
+    flush = f"{statistics.median(flushes):.3f}" if flushes else "-"
+    print(
+        f"{summary['animals']:>12,}"
+        f"{summary['plots']:>12,}"
+        f"{summary['load_s']:>10.1f}"
+        f"{wall:>10.3f}"
+        f"{statistics.median(t['rows'] for t in ticks):>12,.0f}"
+        f"{statistics.median(t['items'] for t in ticks):>12,.0f}"
+        f"{max(t['peak_rss'] for t in ticks) / 2 ** 20:>10,.0f}"
+        f"{db_ms:>10}"
+        f"{wall / utils.PRODUCTION_TICK_INTERVAL:>10.1%}"
+        f"{flush:>10}"
+    )
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    dsn = os.getenv("FARMER_BENCHMARK_DSN")
+    if not dsn:
+        sys.exit("FARMER_BENCHMARK_DSN needs to be set to a local Postgres")
+
+    print(
+        f"Mode {args.mode}, {args.ticks} ticks a size, "
+        f"{args.shards} shards at concurrency {args.concurrency}"
+    )
+    print(
+        f"{'animals':>12}{'plots':>12}{'load s':>10}{'tick s':>10}"
+        f"{'rows':>12}{'items':>12}{'RSS MiB':>10}{'db ms':>10}{'of tick':>10}{'flush s':>10}"
+    )
+    results = []
+    for size in args.sizes:
+        summary = await run_size(dsn, size, args)
+        print_summary(summary)
+        results.append(summary)
+        if args.output:
+            args.output.write_text(json.dumps({
+                "mode": args.mode,
+                "shards": args.shards,
+                "concurrency": args.concurrency,
+                "sizes": results,
+            }, indent=4) + "\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda s: [int(i) for i in s.split(",")],
+        default=list(DEFAULT_SIZES),
+        help="Comma separated numbers of animals to test with.",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=[
+            m.value for m in utils.ProductionMode
+            if m != utils.ProductionMode.LAZY
+        ],
+        default=(
+            utils.PRODUCTION_MODE.value
+            if utils.PRODUCTION_MODE != utils.ProductionMode.LAZY
+            else utils.ProductionMode.TICK.value
+        ),
+    )
+    parser.add_argument("--ticks", type=int, default=3)
+    parser.add_argument("--shards", type=int, default=utils.PRODUCTION_SHARDS)
+    parser.add_argument("--concurrency", type=int, default=utils.PRODUCTION_CONCURRENCY)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file.")
+    parser.add_argument("--keep", action="store_true", help="Don't drop the databases afterwards.")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Compare the cost of building animal and plot records from rows, using the
+slotted classes in ``utils`` and the compact schema's rows against the
+dict-backed classes and TEXT rows that they replaced.
+
+    python -m benchmarks.records [--rows 1000000]
+
+Rows are plain mappings unless ``FARMER_BENCHMARK_DSN`` is set, in which case
+they're real asyncpg records selected from ``generate_series``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import os
+import random
+import time
+import tracemalloc
+from typing import Any, Callable, Sequence
+from uuid import uuid4
+
+import utils
+from utils.animal import PRODUCTION_RATE_CURVE
+
+
+class DictAnimal:
+    """
+    The dict-backed animal class, as it was before ``__slots__`` and the
+    compact schema.
+    """
+
+    def __init__(self, *, id, type, plot_id, production_rate=None):
+        self.id = str(id) if id is not None else str(uuid4())
+        self.type = type
+        self.plot_id = str(plot_id)
+        self.production_rate = (
+            random.choice(PRODUCTION_RATE_CURVE)
+            if production_rate is None
+            else production_rate
+        )
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            id=row["id"],
+            type=utils.AnimalType[row["type"]],
+            plot_id=row["plot_id"],
+            production_rate=row["production_rate"],
+        )
+
+
+class DictPlot:
+    """
+    The dict-backed plot class, as it was before ``__slots__`` and the
+    compact schema.
+    """
+
+    def __init__(self, *, id, guild_id, owner_id, position, type):
+        self.id = str(id) if id is not None else str(uuid4())
+        self.guild_id = guild_id
+        self.owner_id = owner_id
+        self.position = tuple(position)
+        self.type = type
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            id=row["id"],
+            owner_id=row["owner_id"],
+            guild_id=row["guild_id"],
+            position=row["position"],
+            type=utils.PlotType[row["type"]],
+        )
+
+
+def make_animal_rows(count: int, compact: bool) -> list[dict[str, Any]]:
+    types = list(utils.AnimalType)
+    rows = []
+    for _ in range(count):
+        type = random.choice(types)
+        rows.append({
+            "id": uuid4() if compact else str(uuid4()),
+            "type": type.code if compact else type.name,
+            "plot_id": uuid4() if compact else str(uuid4()),
+            "production_rate": random.random(),
+        })
+    return rows
+
+
+def make_plot_rows(count: int, compact: bool) -> list[dict[str, Any]]:
+    types = list(utils.PlotType)
+    rows = []
+    for _ in range(count):
+        type = random.choice(types)
+        x, y = random.randrange(5), random.randrange(5)
+        rows.append({
+            "id": uuid4() if compact else str(uuid4()),
+            "owner_id": random.getrandbits(63),
+            "guild_id": random.getrandbits(63),
+            **({"x": x, "y": y} if compact else {"position": [x, y]}),
+            "type": type.code if compact else type.name,
+        })
+    return rows
+
+
+async def fetch_rows(dsn: str, count: int, compact: bool) -> tuple[list, list]:
+    import asyncpg
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        if compact:
+            animals = await conn.fetch(
+                """
+                SELECT
+                    GEN_RANDOM_UUID() AS id,
+                    (1 + i % 25)::SMALLINT AS type,
+                    GEN_RANDOM_UUID() AS plot_id,
+                    RANDOM() AS production_rate
+                FROM
+                    GENERATE_SERIES(1, $1) i
+                """,
+                count,
+            )
+            plots = await conn.fetch(
+                """
+                SELECT
+                    GEN_RANDOM_UUID() AS id,
+                    i AS owner_id,
+                    i AS guild_id,
+                    (i % 5)::SMALLINT AS x,
+                    (i / 5 % 5)::SMALLINT AS y,
+                    (1 + i % 4)::SMALLINT AS type
+                FROM
+                    GENERATE_SERIES(1, $1) i
+                """,
+                count,
+            )
+        else:
+            animals = await conn.fetch(
+                """
+                SELECT
+                    GEN_RANDOM_UUID()::TEXT AS id,
+                    (ARRAY['COW', 'PIG', 'SHEEP', 'GOAT'])[1 + i % 4] AS type,
+                    GEN_RANDOM_UUID()::TEXT AS plot_id,
+                    RANDOM() AS production_rate
+                FROM
+                    GENERATE_SERIES(1, $1) i
+                """,
+                count,
+            )
+            plots = await conn.fetch(
+                """
+                SELECT
+                    GEN_RANDOM_UUID()::TEXT AS id,
+                    i AS owner_id,
+                    i AS guild_id,
+                    ARRAY[i % 5, i / 5 % 5]::SMALLINT[] AS position,
+                    (ARRAY['FARM', 'GARDEN', 'LAKE', 'SKY'])[1 + i % 4] AS type
+                FROM
+                    GENERATE_SERIES(1, $1) i
+                """,
+                count,
+            )
+    finally:
+        await conn.close()
+    return animals, plots
+
+
+def measure(build: Callable[[Any], Any], rows: Sequence[Any]) -> tuple[float, int]:
+    """
+    Build an object from every row, returning the time taken per row in
+    nanoseconds and the bytes allocated per object.
+    """
+
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter_ns()
+        built = [build(r) for r in rows]
+        elapsed = time.perf_counter_ns() - start
+    finally:
+        gc.enable()
+    del built
+
+    gc.collect()
+    tracemalloc.start()
+    built = [build(r) for r in rows]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del built
+    return elapsed / len(rows), size // len(rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    dsn = os.getenv("FARMER_BENCHMARK_DSN")
+    if dsn:
+        legacy = asyncio.run(fetch_rows(dsn, args.rows, False))
+        compact = asyncio.run(fetch_rows(dsn, args.rows, True))
+        source = "asyncpg records"
+    else:
+        legacy = make_animal_rows(args.rows, False), make_plot_rows(args.rows, False)
+        compact = make_animal_rows(args.rows, True), make_plot_rows(args.rows, True)
+        source = "mappings"
+
+    print(f"{args.rows:,} rows from {source}")
+    print(f"{'class':<24}{'ns/row':>10}{'bytes/row':>12}")
+    for name, build, rows in [
+            ("Animal (dict)", DictAnimal.from_row, legacy[0]),
+            ("Animal (slots)", utils.Animal.from_row, compact[0]),
+            ("Plot (dict)", DictPlot.from_row, legacy[1]),
+            ("Plot (slots)", utils.Plot.from_row, compact[1])]:
+        ns, size = measure(build, rows)
+        print(f"{name:<24}{ns:>10,.0f}{size:>12,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import novus as n
+from novus import types as t
+from novus.utils import Localization as LC
+from novus.ext import client, database as db
+
+import utils
+
+
+class Farm(client.Plugin):
+
+    farm = client.CommandDescription(
+        # "farm" command command name
+        name_localizations=LC._("farm"),
+    )
+
+    @client.command(
+        name="farm overview",
+        # "farm overview" subcommand command name
+        name_localizations=LC._("overview"),
+        # "farm overview" subcommand description
+        description_localizations=LC._("Show you all of your plots of land at once."),
+        dm_permission=False,
+    )
+    async def farm_overview(self, ctx: t.CommandI):
+        """
+        Show you all of your plots of land at once.
+        """
+
+        # Get the plots that the user owns, and everything in them
+        assert ctx.guild
+        async with db.Database.acquire() as conn:
+            plots = await utils.Plot.fetch_for_user(
+                conn,
+                ctx.guild.id,
+                ctx.user.id,
+            )
+            if not plots:
+                return await ctx.send(
+                    ctx._("You don't have any plots yet :("),
+                )
+            inventories = await utils.PlotItems.fetch_many(
+                conn,
+                [p.id for p in plots],
+            )
+            plots = await utils.PlotWithAnimals.fetch_many(conn, plots)
+
+        # Add a field for each plot
+        embed = n.Embed(
+            title=ctx._("Farm"),
+            color=0xf17824,
+        ).set_author_from_user(ctx.user)
+        for plot in sorted(plots, key=lambda p: p.position):
+            x, y = plot.position
+            animals = "".join(a.emoji for a in plot.animals)
+            items = "\n".join(
+                f"\N{BULLET} {i!s}"
+                for i in sorted(
+                    inventories[plot.id].items,
+                    key=lambda i: i.amount,
+                )
+            )
+            embed.add_field(
+                f"{plot.type.value.name.title()} ({x + 1}, {y + 1})",
+                "\n".join([
+                    animals or ctx._("No animals yet :("),
+                    items or ctx._("Nothing yet :("),
+                ]),
+            )
+        await ctx.send(embeds=[embed])
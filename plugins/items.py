@@ -1,21 +1,79 @@
 from __future__ import annotations
 
 from typing import TYPE_CHECKING
-from difflib import SequenceMatcher
 
 import novus as n
 from novus import types as t
 from novus.utils import Localization as LC
 from novus.ext import client, database as db
 
-from utils import AnimalType, UserItems
+from utils import INVENTORY_CACHE, ITEM_SEARCH, STATEMENTS, Animal, AnimalType
 
 if TYPE_CHECKING:
     import asyncpg
 
+    from utils import UserItems
 
-def get_similarity(a: str, b: str) -> float:
-    return SequenceMatcher(None, a, b).ratio()
+
+BASE_SELL_PRICE = 50
+MIN_SELL_MULTIPLIER = 0.2
+MARKET_MIN_GUILD_ANIMALS = 10  # Animals in a guild before the market kicks in
+MARKET_MIN_SHARE = 0.05  # Share of a guild's animals before a type gets cheaper
+MARKET_MIN_USER_ANIMALS = 5  # Animals a seller needs before the market applies
+
+
+REMOVE_USER_ITEMS = STATEMENTS.register(
+    "remove_user_items",
+    """
+    UPDATE
+        user_items
+    SET
+        amount = amount - $4
+    WHERE
+        owner_id = $1
+        AND guild_id = $2
+        AND item = $3
+    RETURNING
+        amount
+    """,
+)
+
+ADD_USER_MONEY = STATEMENTS.register(
+    "add_user_money",
+    """
+    INSERT INTO
+        inventory
+        (
+            owner_id,
+            guild_id,
+            money
+        )
+    VALUES
+        ($1, $2, $3)
+    ON CONFLICT
+        (owner_id, guild_id)
+    DO UPDATE SET
+        money = inventory.money + excluded.money
+    RETURNING
+        money
+    """,
+)
+
+
+def get_sell_choices(user_items: UserItems, query: str) -> list[n.ApplicationCommandChoice]:
+    """
+    Get the autocomplete choices for a user's items, best match first.
+    """
+
+    scores = ITEM_SEARCH.search(query)
+    return [
+        n.ApplicationCommandChoice(f"{i.amount}x {i.animal.value.product[-1].title()}", i.animal.name)
+        for i in sorted(
+            user_items.items,
+            key=lambda i: (scores.get(i.animal, 0.0), i.amount),
+            reverse=True,
+        )[:25]
+    ]
 
 
 class Items(client.Plugin):
@@ -24,12 +82,29 @@ class Items(client.Plugin):
             self,
             conn: asyncpg.Connection,
             guild: n.types.Snowflake,
+            user: n.types.Snowflake,
             animal: AnimalType) -> int:
         """
         Get the sell price of an item for a particular guild.
+
+        Items are worth the base price until there are more than
+        ``MARKET_MIN_GUILD_ANIMALS`` animals in the guild, more than
+        ``MARKET_MIN_SHARE`` of them are the item's animal, and the seller
+        has more than ``MARKET_MIN_USER_ANIMALS`` animals. Past that, the
+        price drops in proportion to how common the animal is.
         """
 
-        return 50
+        census = await Animal.census.fetch(conn, guild.id)
+        if census.total <= MARKET_MIN_GUILD_ANIMALS:
+            return BASE_SELL_PRICE
+        share = census.get_share(animal)
+        if share <= MARKET_MIN_SHARE:
+            return BASE_SELL_PRICE
+        user_animals = await Animal.fetch_count_for_user(conn, guild.id, user.id)
+        if user_animals <= MARKET_MIN_USER_ANIMALS:
+            return BASE_SELL_PRICE
+        multiplier = max(MIN_SELL_MULTIPLIER, MARKET_MIN_SHARE / share)
+        return round(BASE_SELL_PRICE * multiplier)
 
     @client.command(
         name_localizations=LC._("sell"),
@@ -61,23 +136,25 @@ class Items(client.Plugin):
             return await ctx.send("That item is not valid :/")
         animal = AnimalType[item]
 
-        # Check that they have enough of that item
+        # Check that they have enough of that item; the sell button checks
+        # again when the items are actually taken
         assert ctx.guild
+        _, user_items = await INVENTORY_CACHE.fetch(
+            db.Database.acquire,
+            ctx.guild.id,
+            ctx.user.id,
+        )
+        current_amount = next(
+            (i.amount for i in user_items.items if i.animal == animal),
+            None,
+        )
         async with db.Database.acquire() as conn:
-            current_amount = await conn.fetchval(
-                """
-                SELECT
-                    amount
-                FROM
-                    user_items
-                WHERE
-                    owner_id = $1
-                    AND guild_id = $2
-                    AND item = $3
-                """,
-                ctx.user.id, ctx.guild.id, animal.name,
+            sell_price = await self.get_sell_price(
+                conn,
+                ctx.guild,
+                ctx.user,
+                animal,
             )
-            sell_price = await self.get_sell_price(conn, ctx.guild, animal)
         amount_adjusted = False
         if current_amount is None or current_amount <= 0:
             return await ctx.send(
@@ -132,18 +209,16 @@ class Items(client.Plugin):
             self,
             ctx: t.CommandI,
             options: dict[str, n.InteractionOption]) -> list[n.ApplicationCommandChoice]:
+        # Autocomplete is sent on every keystroke, so the user's items are
+        # only fetched once per burst of typing
         assert ctx.guild
-        async with db.Database.acquire() as conn:
-            user_items = await UserItems.fetch(conn, ctx.guild.id, ctx.user.id)
+        _, user_items = await INVENTORY_CACHE.fetch(
+            db.Database.acquire,
+            ctx.guild.id,
+            ctx.user.id,
+        )
         current_string: str = options["item"].value  # pyright: ignore
-        return sorted(
-            [
-                n.ApplicationCommandChoice(f"{i.amount}x {i.animal.value.product[-1].title()}", i.animal.name)
-                for i in user_items.items
-            ],
-            key=lambda acc: get_similarity(str(acc.value).lower(), current_string.lower()),
-            reverse=True,
-        )[:25]
+        return get_sell_choices(user_items, current_string)
 
     @client.event.filtered_component(r"^SELL .*$")
     async def sell_button_pressed(self, ctx: t.ComponentI):
@@ -166,46 +241,20 @@ class Items(client.Plugin):
         assert ctx.guild
         async with db.Database.acquire() as conn:
             async with conn.transaction():
-                new_amount = await conn.fetchval(
-                    """
-                    UPDATE
-                        user_items
-                    SET
-                        amount = amount - $4
-                    WHERE
-                        owner_id = $1
-                        AND guild_id = $2
-                        AND item = $3
-                    RETURNING
-                        amount
-                    """,
-                    ctx.user.id, ctx.guild.id, animal.name, amount,
+                new_amount = await REMOVE_USER_ITEMS.fetchval(
+                    conn,
+                    ctx.user.id, ctx.guild.id, animal.code, amount,
                 )
                 if (new_amount or 0) < 0:
                     return await ctx.update(
                         content=ctx._("You don't have enough of that item to make this sale!"),
                         components=None,
                     )
-                new_money = await conn.fetchval(
-                    """
-                    INSERT INTO
-                        inventory
-                        (
-                            owner_id,
-                            guild_id,
-                            money
-                        )
-                    VALUES
-                        ($1, $2, $3)
-                    ON CONFLICT
-                        (owner_id, guild_id)
-                    DO UPDATE SET
-                        money = inventory.money + excluded.money
-                    RETURNING
-                        money
-                    """,
+                new_money = await ADD_USER_MONEY.fetchval(
+                    conn,
                     ctx.user.id, ctx.guild.id, sell_price * amount,
                 )
+        INVENTORY_CACHE.invalidate(ctx.guild.id, ctx.user.id)
         await ctx.update(
             content=(
                 ctx._("You have sold **{amount}x {item}**! You now have **{money} gold** :3")
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+from collections import OrderedDict
+from enum import Enum
+import functools
+import hashlib
 import itertools
 import random
-from typing import TYPE_CHECKING, Any, Callable, overload
+from typing import TYPE_CHECKING, Any, overload
 
 import novus as n
 from novus import types as t
@@ -12,10 +16,171 @@ from novus.ext import client, database as db
 import utils
 
 if TYPE_CHECKING:
+    from uuid import UUID
+
     import asyncpg
 
 
 BUTTON_POSITIONS = set(list(itertools.permutations([0, 1, 2, 3, 4] * 2, 2)))
+PLOT_TYPES = list(utils.PlotType)
+
+# Only the rows that are deleted are moved and taken off the plot's count,
+# so items produced while the claim runs stay on the plot and are counted
+CLAIM_PLOT_ITEMS = utils.STATEMENTS.register(
+    "claim_plot_items",
+    """
+    WITH cleared AS (
+        DELETE FROM
+            plot_items
+        WHERE
+            plot_id = $3
+        RETURNING
+            item,
+            amount
+    ),
+    moved AS (
+        INSERT INTO
+            user_items
+            (
+                owner_id,
+                guild_id,
+                item,
+                amount
+            )
+        SELECT
+            $1,
+            $2,
+            item,
+            amount
+        FROM
+            cleared
+        ON CONFLICT (owner_id, guild_id, item)
+        DO UPDATE
+        SET
+            amount = user_items.amount + excluded.amount
+    ),
+    claimed AS (
+        SELECT
+            COALESCE(SUM(amount), 0) AS amount
+        FROM
+            cleared
+    ),
+    counted AS (
+        UPDATE
+            plots
+        SET
+            item_count = GREATEST(plots.item_count - claimed.amount, 0),
+            version = plots.version + 1
+        FROM
+            claimed
+        WHERE
+            plots.id = $3
+    )
+    SELECT
+        amount
+    FROM
+        claimed
+    """,
+)
+
+
+@functools.lru_cache(maxsize=10_000)
+def get_plot_layout(guild_id: int, user_id: int) -> bytes:
+    """
+    Get the plot type of every cell in a user's grid as an index into
+    ``PLOT_TYPES``, one byte per cell, row by row.
+
+    This is seeded from a BLAKE2 hash of the guild and user IDs so that it's
+    the same across processes and Python versions.
+    """
+
+    digest = hashlib.blake2b(
+        f"{guild_id} {user_id}".encode(),
+        digest_size=25,
+    ).digest()
+    return bytes(i % len(PLOT_TYPES) for i in digest)
+
+
+class PlotButtonMode(Enum):
+    """
+    What a grid of plot buttons is being shown for. The value is the custom
+    ID prefix, and whether owned and open plots can be pressed.
+    """
+
+    SHOW = ("PLOT_SHOW", True, False)
+    PURCHASE = ("PLOT_PURCHASE", False, True)
+    BUY_ANIMAL = ("PLOT_BUY_ANIMAL", True, False)
+
+
+UNOWNED = 0xff
+
+
+@functools.lru_cache(maxsize=10_000)
+def build_plot_buttons(
+        guild_id: int,
+        user_id: int,
+        owned: bytes,
+        mode: PlotButtonMode) -> tuple[n.ActionRow, ...]:
+    """
+    Build the grid of buttons for a user's plots. ``owned`` has one byte per
+    cell, row by row, which is either the index into ``PLOT_TYPES`` of the
+    plot that the user owns there or ``UNOWNED``.
+
+    The grid is cached, so the components returned must not be changed.
+    """
+
+    prefix, owned_plots_enabled, open_plots_enabled = mode.value
+    layout = get_plot_layout(guild_id, user_id)
+    return tuple(
+        n.ActionRow([
+            n.Button(
+                label="\u200b",
+                custom_id=f"{prefix} {user_id} {x} {y}",
+                disabled=(
+                    not owned_plots_enabled
+                    if owned[x * 5 + y] != UNOWNED
+                    else not open_plots_enabled
+                ),
+                style=PLOT_TYPES[
+                    layout[x * 5 + y]
+                    if owned[x * 5 + y] == UNOWNED
+                    else owned[x * 5 + y]
+                ].value.style,
+            )
+            for y in range(5)
+        ])
+        for x in range(5)
+    )
+
+
+class PlotViewCache:
+    """
+    A bounded LRU cache of rendered PLOT_SHOW payloads, keyed by plot ID,
+    plot version and locale. A plot's version changes whenever it does, so
+    old entries are never served and just age out.
+    """
+
+    def __init__(self, maxsize: int = 1_000):
+        self.maxsize = maxsize
+        self.views: OrderedDict[tuple[UUID, int, str], dict[str, Any]] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, plot_id: UUID, version: int, locale: str) -> dict[str, Any] | None:
+        try:
+            view = self.views[(plot_id, version, locale)]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.views.move_to_end((plot_id, version, locale))
+        self.hits += 1
+        return view
+
+    def set(self, plot_id: UUID, version: int, locale: str, view: dict[str, Any]) -> None:
+        self.views[(plot_id, version, locale)] = view
+        self.views.move_to_end((plot_id, version, locale))
+        while len(self.views) > self.maxsize:
+            self.views.popitem(last=False)
 
 
 async def can_only_press(user_id: int, ctx: n.Interaction, command: client.Command) -> bool:
@@ -36,85 +201,104 @@ async def can_only_press(user_id: int, ctx: n.Interaction, command: client.Comma
 
 class Plots(client.Plugin):
 
-    @client.loop(60)
+    # Only one process runs the production loop at a time
+    leader = utils.Leader(db.Database.acquire)
+
+    plot_views = PlotViewCache()
+
+    async def on_unload(self):
+        await self.flush_produced_items()
+        utils.AnimalTable.current = None
+        await self.leader.resign()
+
+    async def load_animal_table(self):
+        """
+        Load the resident animal table if this production mode uses one.
+        """
+
+        table_type = {
+            utils.ProductionMode.RESIDENT: utils.AnimalTable,
+            utils.ProductionMode.SCHEDULED: utils.ScheduledAnimalTable,
+        }.get(utils.PRODUCTION_MODE)
+        if table_type is None:
+            return
+        async with db.Database.acquire() as conn:
+            utils.AnimalTable.current = await table_type.load(conn)
+        self.log.info(
+            "Loaded %s animals into the resident animal table",
+            utils.AnimalTable.current.size,
+        )
+
+    @client.loop(utils.PRODUCTION_TICK_INTERVAL)
     async def animal_item_production(self):
         """
         Loop through every animal, making the animal produce an item inside its
         relevant plot.
         """
 
-        random_key = random.random()
+        # Lazy production is worked out whenever a plot is looked at
+        if utils.PRODUCTION_MODE == utils.ProductionMode.LAZY:
+            return
 
-        # And do our stuff
-        async with db.Database.acquire() as conn:
+        # Make sure that we're the process that should be producing; if we
+        # just lost that then hand over whatever we haven't written yet
+        if not await self.leader.is_leader():
+            if utils.AnimalTable.current is not None:
+                await self.flush_produced_items()
+                utils.AnimalTable.current = None
+            return
 
-            # Get all animals that can produce
-            animal_rows = await conn.fetch(
-                """
-                SELECT
-                    *
-                FROM
-                    animals
-                WHERE
-                    production_rate >= $1
-                """,
-                random_key,
+        # Resident tables only see the animals and claims of the process
+        # that they're in, so they're only used while it's the only one
+        resident = utils.PRODUCTION_MODE in (
+            utils.ProductionMode.RESIDENT,
+            utils.ProductionMode.SCHEDULED,
+        )
+        members = await self.leader.count_members() if resident else 1
+        if members > 1:
+            if utils.AnimalTable.current is not None:
+                self.log.warning(
+                    "%s processes are running, so production is using ticks "
+                    "instead of the resident animal table",
+                    members,
+                )
+                await self.flush_produced_items()
+                utils.AnimalTable.current = None
+        elif utils.AnimalTable.current is None:
+            await self.load_animal_table()
+
+        # Resident production is counted in memory and flushed separately
+        random_key = random.random()
+        table = utils.AnimalTable.current
+        shards = await utils.run_production_tick(
+            db.Database.acquire,
+            random_key,
+        )
+        result = utils.ProductionResult.total(shards)
+        if isinstance(table, utils.ScheduledAnimalTable):
+            self.log.info(
+                "%s scheduled animals produced an item into %s pending rows",
+                result.items, result.rows,
             )
-            animals = [utils.Animal.from_row(i) for i in animal_rows]
-
-            # Get each plot that can support more items
-            all_plot_ids = list(set([i.plot_id for i in animals]))
-            plot_rows = await conn.fetch(
-                """
-                SELECT
-                    plot_id,
-                    SUM(amount)
-                FROM
-                    plot_items
-                WHERE
-                    plot_id = ANY($1::TEXT[])
-                GROUP BY
-                    plot_id
-                HAVING
-                    SUM(amount) >= 100
-                """,
-                all_plot_ids,
+            return
+        elif table is not None:
+            self.log.info(
+                "%s animals produced an item into %s pending rows (%s)",
+                result.items, result.rows, random_key,
             )
+            return
 
-            # Produce an item
-            invalid_plot_ids = [r["plot_id"] for r in plot_rows]
-            producing_animal_ids = [
-                (i.plot_id, i.type.name)
-                for i in animals
-                if i.plot_id not in invalid_plot_ids
-            ]
-            await conn.executemany(
-                """
-                INSERT INTO
-                    plot_items
-                    (
-                        plot_id,
-                        item,
-                        amount
-                    )
-                VALUES
-                    (
-                        $1,
-                        $2,
-                        1
-                    )
-                ON CONFLICT
-                    (plot_id, item)
-                DO UPDATE
-                SET
-                    amount = plot_items.amount + excluded.amount
-                """,
-                producing_animal_ids,
+        for s in shards:
+            self.log.debug(
+                "Shard %s produced %s items across %s rows in %.3fs",
+                s.shard, s.result.items, s.result.rows, s.duration,
             )
-        if producing_animal_ids:
+        if result.items:
             self.log.info(
-                "Animals produced! %s animals produced an item this loop (%s)",
-                len(producing_animal_ids), random_key,
+                "Animals produced! %s animals produced an item this loop "
+                "across %s rows, slowest shard took %.3fs (%s)",
+                result.items, result.rows,
+                max(s.duration for s in shards), random_key,
             )
         else:
             self.log.info(
@@ -122,6 +306,39 @@ class Plots(client.Plugin):
                 random_key,
             )
 
+    @client.loop(utils.PRODUCTION_FLUSH_INTERVAL)
+    async def flush_produced_items(self):
+        """
+        Write the items produced by the resident animal table into the
+        database.
+        """
+
+        if utils.AnimalTable.current is None:
+            return
+        async with db.Database.acquire() as conn:
+            rows = await utils.AnimalTable.current.flush(conn)
+        self.log.info("Flushed %s pending plot item rows", rows)
+
+    @client.loop(utils.COUNTER_CHECK_INTERVAL)
+    async def repair_counters(self):
+        """
+        Fix any animal counts or census counts that no longer match the
+        animals that they count.
+        """
+
+        if not await self.leader.is_leader():
+            return
+        async with db.Database.acquire() as conn:
+            drift = [
+                *await utils.check_animal_counts(conn, repair=True),
+                *await utils.check_animal_census(conn, repair=True),
+            ]
+        for d in drift:
+            self.log.warning(
+                "Repaired counter %s from %s to %s",
+                d.key, d.stored, d.actual,
+            )
+
     @staticmethod
     def get_plot_type(
             guild_id: int,
@@ -130,11 +347,10 @@ class Plots(client.Plugin):
             y: int) -> utils.PlotType:
         """
         Generate a plot type from a user ID. This is random, seeded with the
-        user ID, and generated from the X and Y coordinate's hash.
+        guild and user IDs, and picked by the X and Y coordinate.
         """
 
-        r = random.Random(hash((guild_id, user_id, x, y,)))
-        return r.choice(list(utils.PlotType))
+        return PLOT_TYPES[get_plot_layout(guild_id, user_id)[x * 5 + y]]
 
     @overload
     @classmethod
@@ -167,9 +383,10 @@ class Plots(client.Plugin):
         Get all of the plots available for a given user.
         """
 
+        layout = get_plot_layout(guild_id, user_id)
         user_plots: dict[tuple[int, int], utils.PlotType | utils.Plot]
         user_plots = {
-            (x, y): cls.get_plot_type(guild_id, user_id, x, y)
+            (x, y): PLOT_TYPES[layout[x * 5 + y]]
             for x, y in BUTTON_POSITIONS
         }
         if owned_plots:
@@ -183,50 +400,16 @@ class Plots(client.Plugin):
             guild_id: int,
             user_id: int,
             plots: list[utils.Plot],
-            *,
-            owned_plots_enabled: bool,
-            open_plots_enabled: bool,
-            content: Callable[[int, int, int, utils.PlotType | utils.Plot], str] = lambda user_id, x, y, plot: "\u200b",
-            custom_id: Callable[[int, int, int, utils.PlotType | utils.Plot], str] = lambda user_id, x, y, plot: "",
-            ) -> list[n.ActionRow]:
+            mode: PlotButtonMode) -> list[n.ActionRow]:
         """
         Get the buttons for the user's plots.
         """
 
-        # See what plots they own
-        owned_plots = {i: False for i in BUTTON_POSITIONS}
-        plot_dict = {i.position: i for i in plots}
+        owned = bytearray([UNOWNED] * 25)
         for p in plots:
-            owned_plots[p.position] = True
-
-        # Show buttons with plots they can purchase
-        plot_types = cls.get_user_plots(guild_id, user_id)
-        components = [
-            n.ActionRow([
-                n.Button(
-                    label=content(
-                        user_id,
-                        x,
-                        y,
-                        plot_dict.get((x, y)) or plot_types[(x, y)]
-                    ),
-                    custom_id=custom_id(
-                        user_id,
-                        x,
-                        y,
-                        plot_dict.get((x, y)) or plot_types[(x, y)]
-                    ),
-                    disabled=(
-                        (owned_plots[(x, y)] and (not owned_plots_enabled))
-                        or ((not owned_plots[(x, y)]) and (not open_plots_enabled))
-                    ),
-                    style=plot_types[(x, y)].value.style,
-                )
-                for y in range(5)
-            ])
-            for x in range(5)
-        ]
-        return components
+            x, y = p.position
+            owned[x * 5 + y] = PLOT_TYPES.index(p.type)
+        return list(build_plot_buttons(guild_id, user_id, bytes(owned), mode))
 
     @staticmethod
     def get_plot_price(current_plot_count: int) -> int:
@@ -290,9 +473,7 @@ class Plots(client.Plugin):
             ctx.guild.id,
             ctx.user.id,
             plots,
-            owned_plots_enabled=False,
-            open_plots_enabled=True,
-            custom_id=lambda user_id, x, y, plot: f"PLOT_PURCHASE {user_id} {x} {y}",
+            PlotButtonMode.PURCHASE,
         )
         await ctx.send(
             (
@@ -318,8 +499,8 @@ class Plots(client.Plugin):
         async with db.Database.acquire() as conn:
             plots = await utils.Plot.fetch_for_user(
                 conn,
-                ctx.user.id,
                 ctx.guild.id,
+                ctx.user.id,
             )
 
             # They have plots already - lets see if they have the money to buy
@@ -419,9 +600,7 @@ class Plots(client.Plugin):
             ctx.guild.id,
             ctx.user.id,
             plots,
-            owned_plots_enabled=True,
-            open_plots_enabled=False,
-            custom_id=lambda user_id, x, y, plot: f"PLOT_SHOW {user_id} {x} {y}",
+            PlotButtonMode.SHOW,
         )
         if ctx.custom_id:
             await ctx.update(content=None, embeds=None, components=components)
@@ -465,9 +644,17 @@ class Plots(client.Plugin):
                 # We shouldn't get here
                 return await ctx.send("You don't own that plot :(")
 
+            # See if the plot has changed since it was last shown
+            await utils.settle_plot(conn, plot.id)
+            version = await plot.fetch_version(conn)
+            view = self.plot_views.get(plot.id, version, ctx.locale)
+            if view is not None:
+                return await ctx.update(**view)
+
             # Get the animals and items for the plot
-            plot = await plot.fetch_animals(conn)
-            plot_inventory = await utils.PlotItems.fetch(conn, plot.id)
+            snapshot = await utils.PlotSnapshot.fetch(conn, plot.id)
+            assert snapshot
+            plot, plot_inventory = snapshot.plot, snapshot.items
 
         # Format items on the plot
         text: str = ""
@@ -495,17 +682,19 @@ class Plots(client.Plugin):
         ])
 
         # And send
-        return await ctx.update(
-            content=str(plot),
-            embeds=[
+        view = {
+            "content": str(plot),
+            "embeds": [
                 n.Embed().add_field(
                     ctx._("Items"),
                     text.strip(),
                     inline=False,
                 ),
             ],
-            components=[ar],
-        )
+            "components": [ar],
+        }
+        self.plot_views.set(plot.id, snapshot.version, ctx.locale, view)
+        return await ctx.update(**view)
 
     @client.event.filtered_component(r"PLOT_MOVE_ITEMS \d+ \d \d")
     async def plot_move_items_button_pressed(self, ctx: t.ComponentI):
@@ -531,43 +720,22 @@ class Plots(client.Plugin):
             if plot is None:
                 # We shouldn't get here
                 return await ctx.send("You don't own that plot :(")
-            plot = await plot.fetch_animals(conn)
-            assert plot
 
-            # Move
-            async with conn.transaction():
-                await conn.execute(
-                    """
-                    INSERT INTO
-                        user_items
-                        (
-                            owner_id,
-                            guild_id,
-                            item,
-                            amount
-                        )
-                    SELECT
-                        $1,
-                        $2,
-                        item,
-                        amount
-                    FROM
-                        plot_items
-                    WHERE
-                        plot_id = $3
-                    ON CONFLICT (owner_id, guild_id, item)
-                    DO UPDATE
-                    SET
-                        amount = user_items.amount + excluded.amount
-                    """,
-                    plot.owner_id,
-                    plot.guild_id,
-                    plot.id,
-                )
-                await conn.execute(
-                    "DELETE FROM plot_items WHERE plot_id = $1",
-                    plot.id,
-                )
+            # Move; the plot is settled first so that resident production's
+            # pending items are claimed too
+            await utils.settle_plot(conn, plot.id)
+            snapshot = await utils.PlotSnapshot.fetch(conn, plot.id)
+            assert snapshot
+            plot = snapshot.plot
+            claimed = await CLAIM_PLOT_ITEMS.fetchval(
+                conn,
+                plot.owner_id,
+                plot.guild_id,
+                plot.id,
+            )
+            if utils.AnimalTable.current is not None:
+                utils.AnimalTable.current.clear_plot(plot.id, claimed)
+            utils.INVENTORY_CACHE.invalidate(plot.guild_id, plot.owner_id)
 
         # And send
         await ctx.update(
@@ -625,9 +793,7 @@ class Plots(client.Plugin):
             ctx.guild.id,
             ctx.user.id,
             plots,
-            owned_plots_enabled=True,
-            open_plots_enabled=False,
-            custom_id=lambda user_id, x, y, plot: f"PLOT_BUY_ANIMAL {user_id} {x} {y}",
+            PlotButtonMode.BUY_ANIMAL,
         )
         await ctx.send(
             (
@@ -647,20 +813,7 @@ class Plots(client.Plugin):
         """
 
         # Get the number of animals they currently have
-        count = await conn.fetchval(
-            """
-            SELECT
-                COUNT(*)
-            FROM
-                animals
-                LEFT JOIN plots ON animals.plot_id = plots.id
-            WHERE
-                plots.owner_id = $1
-                AND plots.guild_id = $2
-            """,
-            user_id, guild_id,
-        )
-        count = count or 0
+        count = await utils.Animal.fetch_count_for_user(conn, guild_id, user_id)
         return (250 * count ** 2) + (750 * count) - 10
 
     @client.event.filtered_component(r"PLOT_BUY_ANIMAL \d+ \d \d")
@@ -684,6 +837,10 @@ class Plots(client.Plugin):
             # Get animal purchase price
             purchase_price = await self.get_animal_buy_price(conn, user_id, ctx.guild.id)
 
+            # Settle the plot so the new animal doesn't get credit for time
+            # before it was bought
+            await utils.settle_plot(conn, plot.id)
+
             # Transaction time
             async with conn.transaction():
 
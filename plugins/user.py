@@ -8,6 +8,39 @@ import utils
 
 class User(client.Plugin):
 
+    async def on_load(self):
+        # Every connection prepares the statement catalog up front, so that
+        # no interaction has to
+        await utils.STATEMENTS.install(db.Database.pool)
+
+    async def on_unload(self):
+        await utils.INVENTORY_CACHE.close()
+
+    @client.loop(10)
+    async def listen_for_inventory_changes(self):
+        """
+        Keep the inventory cache listening for changes made by any process,
+        reconnecting if its connection has dropped.
+        """
+
+        if not await utils.INVENTORY_CACHE.listen(db.Database.acquire):
+            self.log.warning("Inventory cache couldn't listen for changes")
+
+    @client.loop(5 * 60)
+    async def log_cache_stats(self):
+        """
+        Log how well the caches in front of the database are doing.
+        """
+
+        for name, stats in [
+                ("Inventory", utils.INVENTORY_CACHE.stats()),
+                ("Plot", utils.Plot.cache.stats())]:
+            self.log.info(
+                "%s cache: %s",
+                name,
+                ", ".join(f"{k}={v:.3g}" if isinstance(v, float) else f"{k}={v}" for k, v in stats.items()),
+            )
+
     @client.command(
         name="inventory",
         # "inventory [user?]" command name
@@ -40,9 +73,11 @@ class User(client.Plugin):
         assert ctx.guild
         user = user or ctx.user  # pyright: ignore
         assert user
-        async with db.Database.acquire() as conn:
-            money = await utils.Inventory.fetch(conn, ctx.guild.id, user.id)
-            inventory = await utils.UserItems.fetch(conn, ctx.guild.id, user.id)
+        money, inventory = await utils.INVENTORY_CACHE.fetch(
+            db.Database.acquire,
+            ctx.guild.id,
+            user.id,
+        )
 
         # Format items
         description_lines = []
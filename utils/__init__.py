@@ -1,5 +1,13 @@
 from .animal import *
 from .animal_type import *
+from .census import *
+from .counters import *
 from .inventory import *
+from .leader import *
+from .listener import *
 from .plot import *
 from .plot_type import *
+from .production import *
+from .search import *
+from .snapshot import *
+from .statement import *
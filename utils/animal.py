@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, ClassVar
 from typing_extensions import Self
 from uuid import uuid4
 import random
@@ -8,6 +8,9 @@ import random
 import numpy as np
 
 from .animal_type import AnimalType
+from .census import AnimalCensus
+from .production import AnimalTable
+from .statement import STATEMENTS
 
 if TYPE_CHECKING:
     from uuid import UUID
@@ -21,6 +24,154 @@ __all__ = (
 
 PRODUCTION_RATE_CURVE = list(np.random.normal(0.5, 0.115, 1000))  # pyright: ignore
 
+SAVE_ANIMAL = STATEMENTS.register(
+    "save_animal",
+    """
+    WITH previous AS (
+        SELECT
+            plots.guild_id,
+            plots.owner_id,
+            animals.type
+        FROM
+            animals
+            LEFT JOIN plots ON animals.plot_id = plots.id
+        WHERE
+            animals.id = $1
+    ),
+    saved AS (
+        INSERT INTO
+            animals
+            (
+                id,
+                type,
+                plot_id,
+                production_rate
+            )
+        VALUES
+            (
+                $1,
+                $2,
+                $3,
+                $4
+            )
+        ON CONFLICT (id)
+        DO UPDATE
+        SET
+            type = excluded.type,
+            plot_id = excluded.plot_id,
+            production_rate = excluded.production_rate
+        RETURNING *
+    ),
+    bumped AS (
+        UPDATE
+            plots
+        SET
+            version = version + 1
+        WHERE
+            id = $3
+        RETURNING
+            guild_id,
+            owner_id
+    ),
+    counted AS (
+        INSERT INTO
+            animal_census
+            (
+                guild_id,
+                type,
+                count
+            )
+        SELECT
+            guild_id,
+            type,
+            SUM(change)
+        FROM
+            (
+                SELECT
+                    guild_id,
+                    $2::SMALLINT AS type,
+                    1 AS change
+                FROM
+                    bumped
+                UNION ALL
+                SELECT
+                    guild_id,
+                    type,
+                    -1 AS change
+                FROM
+                    previous
+            ) changes
+        GROUP BY
+            guild_id,
+            type
+        HAVING
+            SUM(change) != 0
+        ON CONFLICT (guild_id, type)
+        DO UPDATE
+        SET
+            count = animal_census.count + excluded.count
+        RETURNING
+            animal_census
+    ),
+    owned AS (
+        INSERT INTO
+            inventory
+            (
+                owner_id,
+                guild_id,
+                animal_count
+            )
+        SELECT
+            owner_id,
+            guild_id,
+            SUM(change)
+        FROM
+            (
+                SELECT
+                    owner_id,
+                    guild_id,
+                    1 AS change
+                FROM
+                    bumped
+                UNION ALL
+                SELECT
+                    owner_id,
+                    guild_id,
+                    -1 AS change
+                FROM
+                    previous
+            ) changes
+        GROUP BY
+            owner_id,
+            guild_id
+        HAVING
+            SUM(change) != 0
+        ON CONFLICT (owner_id, guild_id)
+        DO UPDATE
+        SET
+            animal_count = inventory.animal_count + excluded.animal_count
+    )
+    SELECT
+        saved.*,
+        ARRAY(SELECT animal_census FROM counted) AS census
+    FROM
+        saved
+    """,
+)
+
+FETCH_USER_ANIMAL_COUNT = STATEMENTS.register(
+    "fetch_user_animal_count",
+    """
+    SELECT
+        animal_count
+    FROM
+        inventory
+    WHERE
+        owner_id = $1
+        AND guild_id = $2
+    """,
+)
+
 
 class Animal:
     """
@@ -28,24 +179,32 @@ class Animal:
 
     Attributes
     ----------
-    id : str
+    id : UUID
         The ID of the animal.
     type : AnimalType
         The type of the animal.
-    plot_id : str
+    plot_id : UUID
         The ID of the plot that the animal is in.
+    production_rate : float
+        How often the animal produces an item.
+    census : AnimalCensus
+        The number of each type of animal in each guild.
     """
 
+    __slots__ = ("id", "type", "plot_id", "production_rate",)
+
+    census: ClassVar[AnimalCensus] = AnimalCensus()
+
     def __init__(
             self,
             *,
-            id: str | UUID | None,
+            id: UUID | None,
             type: AnimalType,
-            plot_id: str | UUID,
+            plot_id: UUID,
             production_rate: float | None = None):
-        self.id: str = str(id) if id is not None else str(uuid4())
+        self.id: UUID = id if id is not None else uuid4()
         self.type: AnimalType = type
-        self.plot_id: str = str(plot_id)
+        self.plot_id: UUID = plot_id
         self.production_rate = (
             random.choice(PRODUCTION_RATE_CURVE)
             if production_rate is None
@@ -67,44 +226,47 @@ class Animal:
 
         return cls(
             id=row["id"],
-            type=AnimalType[row["type"]],
+            type=AnimalType.from_code(row["type"]),
             plot_id=row["plot_id"],
             production_rate=row["production_rate"],
         )
 
+    @classmethod
+    async def fetch_count_for_user(
+            cls,
+            db: asyncpg.Connection,
+            guild_id: int,
+            user_id: int) -> int:
+        """
+        Get the number of animals that a user has across all of their plots
+        in a guild. This is a counter kept up to date by :meth:`save` and
+        :meth:`Plot.delete`.
+        """
+
+        count = await FETCH_USER_ANIMAL_COUNT.fetchval(db, user_id, guild_id)
+        return count or 0
+
     async def save(self, db: asyncpg.Connection) -> Self:
         """
-        Save the animal into the database.
+        Save the animal into the database, bumping its plot's version and
+        updating the census for its guild and its owner's animal count.
         """
 
-        rows = await db.fetch(
-            """
-            INSERT INTO
-                animals
-                (
-                    id,
-                    type,
-                    plot_id,
-                    production_rate
-                )
-            VALUES
-                (
-                    $1,
-                    $2,
-                    $3,
-                    $4
-                )
-            ON CONFLICT (id)
-            DO UPDATE
-            SET
-                type = excluded.type,
-                plot_id = excluded.plot_id,
-                production_rate = excluded.production_rate
-            RETURNING *
-            """,
+        rows = await SAVE_ANIMAL.fetch(
+            db,
             self.id,
-            self.type.name,
+            self.type.code,
             self.plot_id,
             self.production_rate,
         )
-        return self.from_row(rows[0])
+        animal = self.from_row(rows[0])
+        self.census.update(db, rows[0]["census"])
+
+        # As with the census, a save inside a transaction could still roll
+        # back, so the resident table reads the plot again instead
+        table = AnimalTable.current
+        if table is not None and db.is_in_transaction():
+            table.invalidate_plot(animal.plot_id)
+        elif table is not None:
+            table.update(animal)
+        return animal
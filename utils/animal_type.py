@@ -8,6 +8,7 @@ from .plot_type import PlotType
 __all__ = (
     'AnimalBase',
     'AnimalType',
+    'ANIMAL_TYPE_CODES',
 )
 
 
@@ -104,3 +105,52 @@ class AnimalType(Enum):
 
     if TYPE_CHECKING:
         value: AnimalBase
+
+    @property
+    def code(self) -> int:
+        """
+        The code that the animal type is stored as in the database.
+        """
+
+        return ANIMAL_TYPE_CODES[self]
+
+    @classmethod
+    def from_code(cls, code: int) -> AnimalType:
+        """
+        Get an animal type from the code that it's stored as in the database.
+        """
+
+        return ANIMAL_TYPES_BY_CODE[code]
+
+
+# The code each animal type is stored as in the database. Codes must never be
+# changed or reused - new animal types take the next unused code.
+# Must match the migration in database.pgsql.
+ANIMAL_TYPE_CODES: dict[AnimalType, int] = {
+    AnimalType.COW: 1,
+    AnimalType.PIG: 2,
+    AnimalType.SHEEP: 3,
+    AnimalType.GOAT: 4,
+    AnimalType.TURKEY: 5,
+    AnimalType.ROOSTER: 6,
+    AnimalType.RABBIT: 7,
+    AnimalType.SKUNK: 8,
+    AnimalType.BADGER: 9,
+    AnimalType.MOUSE: 10,
+    AnimalType.HEDGEHOG: 11,
+    AnimalType.SNAIL: 12,
+    AnimalType.OTTER: 13,
+    AnimalType.TURTLE: 14,
+    AnimalType.CROCODILE: 15,
+    AnimalType.DUCK: 16,
+    AnimalType.PENGUIN: 17,
+    AnimalType.OCTOPUS: 18,
+    AnimalType.CRAB: 19,
+    AnimalType.DOVE: 20,
+    AnimalType.EAGLE: 21,
+    AnimalType.OWL: 22,
+    AnimalType.FLAMINGO: 23,
+    AnimalType.PEACOCK: 24,
+    AnimalType.PARROT: 25,
+}
+ANIMAL_TYPES_BY_CODE = {v: k for k, v in ANIMAL_TYPE_CODES.items()}
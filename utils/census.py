@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Iterable
+import os
+import time
+
+from .animal_type import AnimalType
+from .statement import STATEMENTS
+
+if TYPE_CHECKING:
+    import asyncpg
+
+__all__ = (
+    'CENSUS_TTL',
+    'GuildCensus',
+    'AnimalCensus',
+)
+
+
+CENSUS_TTL = float(os.getenv("FARMER_CENSUS_TTL", 60))
+
+FETCH_GUILD_CENSUS = STATEMENTS.register(
+    "fetch_guild_census",
+    """
+    SELECT
+        guild_id,
+        type,
+        count
+    FROM
+        animal_census
+    WHERE
+        guild_id = $1
+    """,
+)
+
+
+class GuildCensus:
+    """
+    How many of each type of animal there are in a guild.
+
+    Attributes
+    ----------
+    guild_id : int
+        The ID of the guild.
+    counts : dict[AnimalType, int]
+        The number of each type of animal.
+    total : int
+        The total number of animals.
+    fetched_at : float
+        The monotonic time that the census was fetched from the database.
+    """
+
+    __slots__ = ("guild_id", "counts", "total", "fetched_at",)
+
+    def __init__(
+            self,
+            guild_id: int,
+            counts: dict[AnimalType, int] | None = None,
+            fetched_at: float | None = None):
+        self.guild_id = guild_id
+        self.counts = counts or {}
+        self.total = sum(self.counts.values())
+        self.fetched_at = time.monotonic() if fetched_at is None else fetched_at
+
+    def set(self, animal: AnimalType, count: int) -> None:
+        """
+        Set the number of an animal type, keeping the total up to date.
+        """
+
+        self.total += count - self.counts.get(animal, 0)
+        self.counts[animal] = count
+
+    def get_share(self, animal: AnimalType) -> float:
+        """
+        Get the fraction of the guild's animals that are of the given type.
+        """
+
+        if not self.total:
+            return 0.0
+        return self.counts.get(animal, 0) / self.total
+
+
+class AnimalCensus:
+    """
+    A cache of the ``animal_census`` table, which holds how many of each
+    type of animal there are in each guild.
+
+    The table is kept up to date by :meth:`Animal.save` and
+    :meth:`Plot.delete` in the same statements that change animals, and they
+    pass the counts they wrote to :meth:`update`. Counts written inside a
+    transaction could still be rolled back, so those guilds are fetched
+    again instead. Other processes' changes are picked up once a guild's
+    entry is older than ``ttl`` seconds.
+
+    Attributes
+    ----------
+    ttl : float
+        How long a guild's census is used for before it's fetched again.
+    guilds : dict[int, GuildCensus]
+        The cached census for each guild.
+    """
+
+    def __init__(self, ttl: float = CENSUS_TTL):
+        self.ttl = ttl
+        self.guilds: dict[int, GuildCensus] = {}
+
+    async def fetch(self, conn: asyncpg.Connection, guild_id: int) -> GuildCensus:
+        """
+        Get the census for a guild, from the cache if it's fresh enough.
+        """
+
+        census = self.guilds.get(guild_id)
+        if census is not None and time.monotonic() - census.fetched_at < self.ttl:
+            return census
+        rows = await FETCH_GUILD_CENSUS.fetch(conn, guild_id)
+        census = GuildCensus(
+            guild_id,
+            {AnimalType.from_code(r["type"]): r["count"] for r in rows},
+        )
+        self.guilds[guild_id] = census
+        return census
+
+    def update(self, conn: asyncpg.Connection, rows: Iterable[dict]) -> None:
+        """
+        Apply census rows that have just been written to the database to any
+        cached guilds. If the connection is in a transaction the guilds are
+        dropped instead, as asyncpg has no way to wait for the commit.
+        """
+
+        if conn.is_in_transaction():
+            for r in rows:
+                self.invalidate(r["guild_id"])
+            return
+        for r in rows:
+            census = self.guilds.get(r["guild_id"])
+            if census is not None:
+                census.set(AnimalType.from_code(r["type"]), r["count"])
+
+    def invalidate(self, guild_id: int) -> None:
+        """
+        Drop a guild's cached census.
+        """
+
+        self.guilds.pop(guild_id, None)
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+import os
+
+from .animal import Animal
+from .animal_type import AnimalType
+from .statement import MAINTENANCE_STATEMENTS
+
+if TYPE_CHECKING:
+    import asyncpg
+
+__all__ = (
+    'COUNTER_CHECK_INTERVAL',
+    'CounterDrift',
+    'check_animal_counts',
+    'check_animal_census',
+)
+
+
+COUNTER_CHECK_INTERVAL = int(os.getenv("FARMER_COUNTER_CHECK_INTERVAL", 60 * 60))
+
+# The drift queries compare each counter against a count taken from the same
+# snapshot. Repairs add the difference rather than setting the count, so that
+# animals saved while the check runs aren't lost.
+ANIMAL_COUNT_DRIFT = """
+    WITH actual AS (
+        SELECT
+            plots.owner_id,
+            plots.guild_id,
+            COUNT(*) AS count
+        FROM
+            animals
+            JOIN plots ON animals.plot_id = plots.id
+        GROUP BY
+            plots.owner_id,
+            plots.guild_id
+    ),
+    drift AS (
+        SELECT
+            COALESCE(inventory.owner_id, actual.owner_id) AS owner_id,
+            COALESCE(inventory.guild_id, actual.guild_id) AS guild_id,
+            COALESCE(inventory.animal_count, 0) AS stored,
+            COALESCE(actual.count, 0) AS actual
+        FROM
+            inventory
+            FULL OUTER JOIN actual
+                ON inventory.owner_id = actual.owner_id
+                AND inventory.guild_id = actual.guild_id
+        WHERE
+            COALESCE(inventory.animal_count, 0) != COALESCE(actual.count, 0)
+    )
+"""
+
+CHECK_ANIMAL_COUNTS = MAINTENANCE_STATEMENTS.register(
+    "check_animal_counts",
+    ANIMAL_COUNT_DRIFT + """
+    SELECT
+        *
+    FROM
+        drift
+    """,
+)
+
+REPAIR_ANIMAL_COUNTS = MAINTENANCE_STATEMENTS.register(
+    "repair_animal_counts",
+    ANIMAL_COUNT_DRIFT + """
+    , repaired AS (
+        INSERT INTO
+            inventory
+            (
+                owner_id,
+                guild_id,
+                animal_count
+            )
+        SELECT
+            owner_id,
+            guild_id,
+            actual - stored
+        FROM
+            drift
+        ON CONFLICT (owner_id, guild_id)
+        DO UPDATE
+        SET
+            animal_count = inventory.animal_count + excluded.animal_count
+    )
+    SELECT
+        *
+    FROM
+        drift
+    """,
+)
+
+CENSUS_DRIFT = """
+    WITH actual AS (
+        SELECT
+            plots.guild_id,
+            animals.type,
+            COUNT(*) AS count
+        FROM
+            animals
+            JOIN plots ON animals.plot_id = plots.id
+        GROUP BY
+            plots.guild_id,
+            animals.type
+    ),
+    drift AS (
+        SELECT
+            COALESCE(animal_census.guild_id, actual.guild_id) AS guild_id,
+            COALESCE(animal_census.type, actual.type) AS type,
+            COALESCE(animal_census.count, 0) AS stored,
+            COALESCE(actual.count, 0) AS actual
+        FROM
+            animal_census
+            FULL OUTER JOIN actual
+                ON animal_census.guild_id = actual.guild_id
+                AND animal_census.type = actual.type
+        WHERE
+            COALESCE(animal_census.count, 0) != COALESCE(actual.count, 0)
+    )
+"""
+
+CHECK_ANIMAL_CENSUS = MAINTENANCE_STATEMENTS.register(
+    "check_animal_census",
+    CENSUS_DRIFT + """
+    SELECT
+        *
+    FROM
+        drift
+    """,
+)
+
+REPAIR_ANIMAL_CENSUS = MAINTENANCE_STATEMENTS.register(
+    "repair_animal_census",
+    CENSUS_DRIFT + """
+    , repaired AS (
+        INSERT INTO
+            animal_census
+            (
+                guild_id,
+                type,
+                count
+            )
+        SELECT
+            guild_id,
+            type,
+            actual - stored
+        FROM
+            drift
+        ON CONFLICT (guild_id, type)
+        DO UPDATE
+        SET
+            count = animal_census.count + excluded.count
+    )
+    SELECT
+        *
+    FROM
+        drift
+    """,
+)
+
+
+class CounterDrift:
+    """
+    A counter that doesn't match the rows that it counts.
+
+    Attributes
+    ----------
+    key : tuple[Any, ...]
+        What the counter is for; ``(guild_id, owner_id)`` for animal counts
+        and ``(guild_id, AnimalType)`` for the census.
+    stored : int
+        The value of the counter.
+    actual : int
+        The number of rows that the counter should have.
+    """
+
+    __slots__ = ("key", "stored", "actual",)
+
+    def __init__(self, key: tuple[Any, ...], stored: int, actual: int):
+        self.key = key
+        self.stored = stored
+        self.actual = actual
+
+    def __repr__(self) -> str:
+        return (
+            f"<CounterDrift key={self.key!r} stored={self.stored} "
+            f"actual={self.actual}>"
+        )
+
+
+async def check_animal_counts(
+        conn: asyncpg.Connection,
+        *,
+        repair: bool = False) -> list[CounterDrift]:
+    """
+    Compare every user's animal count against their animals, optionally
+    fixing any that have drifted.
+    """
+
+    statement = REPAIR_ANIMAL_COUNTS if repair else CHECK_ANIMAL_COUNTS
+    rows = await statement.fetch(conn)
+    return [
+        CounterDrift((r["guild_id"], r["owner_id"]), r["stored"], r["actual"])
+        for r in rows
+    ]
+
+
+async def check_animal_census(
+        conn: asyncpg.Connection,
+        *,
+        repair: bool = False) -> list[CounterDrift]:
+    """
+    Compare every guild's census against its animals, optionally fixing any
+    counts that have drifted.
+    """
+
+    statement = REPAIR_ANIMAL_CENSUS if repair else CHECK_ANIMAL_CENSUS
+    rows = await statement.fetch(conn)
+    drift = [
+        CounterDrift(
+            (r["guild_id"], AnimalType.from_code(r["type"])),
+            r["stored"],
+            r["actual"],
+        )
+        for r in rows
+    ]
+    if repair:
+        for guild_id in {d.key[0] for d in drift}:
+            Animal.census.invalidate(guild_id)
+    return drift
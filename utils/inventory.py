@@ -1,9 +1,15 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Iterable, NoReturn
+from collections import OrderedDict
+from typing import TYPE_CHECKING, AsyncContextManager, Callable, Iterable, NoReturn
 from typing_extensions import Self
+import os
+import time
 
 from .animal import AnimalType
+from .listener import Listener
+from .production import settle_plot, settle_plots
+from .statement import STATEMENTS
 
 if TYPE_CHECKING:
     from uuid import UUID
@@ -17,6 +23,110 @@ __all__ = (
     'UserItems',
     'PlotItems',
     'Inventory',
+    'INVENTORY_CHANNEL',
+    'InventoryCache',
+    'INVENTORY_CACHE',
+)
+
+INVENTORY_CACHE_SIZE = int(os.getenv("FARMER_INVENTORY_CACHE_SIZE", 10_000))
+INVENTORY_CACHE_TTL = float(os.getenv("FARMER_INVENTORY_CACHE_TTL", 5 * 60))
+INVENTORY_CHANNEL = "farmer_inventory"  # Must match database.pgsql
+
+FETCH_USER_ITEMS = STATEMENTS.register(
+    "fetch_user_items",
+    """
+    SELECT
+        *
+    FROM
+        user_items
+    WHERE
+        guild_id = $1
+        AND owner_id = $2
+    """,
+)
+
+FETCH_PLOT_ITEMS = STATEMENTS.register(
+    "fetch_plot_items",
+    """
+    SELECT
+        *
+    FROM
+        plot_items
+    WHERE
+        plot_id = $1
+    """,
+)
+
+FETCH_PLOTS_ITEMS = STATEMENTS.register(
+    "fetch_plots_items",
+    """
+    SELECT
+        *
+    FROM
+        plot_items
+    WHERE
+        plot_id = ANY($1::UUID[])
+    """,
+)
+
+FETCH_INVENTORY = STATEMENTS.register(
+    "fetch_inventory",
+    """
+    SELECT
+        *
+    FROM
+        inventory
+    WHERE
+        guild_id = $1
+        AND owner_id = $2
+    """,
+)
+
+FETCH_USER_INVENTORY = STATEMENTS.register(
+    "fetch_user_inventory",
+    """
+    SELECT
+        COALESCE(inventory.money, 0) AS money,
+        COALESCE(inventory.animal_count, 0) AS animal_count,
+        items.items,
+        items.amounts
+    FROM
+        (SELECT $1::BIGINT AS guild_id, $2::BIGINT AS owner_id) target
+        LEFT JOIN inventory
+            ON inventory.guild_id = target.guild_id
+            AND inventory.owner_id = target.owner_id
+        CROSS JOIN LATERAL (
+            SELECT
+                COALESCE(ARRAY_AGG(item ORDER BY item), '{}') AS items,
+                COALESCE(ARRAY_AGG(amount ORDER BY item), '{}') AS amounts
+            FROM
+                user_items
+            WHERE
+                user_items.guild_id = target.guild_id
+                AND user_items.owner_id = target.owner_id
+                AND user_items.amount > 0
+        ) items
+    """,
+)
+
+SAVE_INVENTORY = STATEMENTS.register(
+    "save_inventory",
+    """
+    INSERT INTO
+        inventory
+        (
+            guild_id,
+            owner_id,
+            money
+        )
+    VALUES
+        ($1, $2, $3)
+    ON CONFLICT
+        (guild_id, owner_id)
+    DO UPDATE SET
+        money = excluded.money
+    RETURNING *
+    """,
 )
 
 
@@ -25,6 +135,8 @@ class Item:
     An item contained within an inventory.
     """
 
+    __slots__ = ("animal", "amount",)
+
     def __init__(self, animal: AnimalType, amount: int = 0):
         self.animal = animal
         self.amount = amount
@@ -48,6 +160,8 @@ class ItemInventory:
     Abstract base class for a user and a plot's inventory.
     """
 
+    __slots__ = ()
+
     items: list[Item]
 
     @classmethod
@@ -58,8 +172,19 @@ class ItemInventory:
 class UserItems(ItemInventory):
     """
     Items that a user has.
+
+    Attributes
+    ----------
+    guild_id : int
+        The ID of the guild that the items are in.
+    user_id : int
+        The ID of the user that has the items.
+    items : list[Item]
+        The items that the user has.
     """
 
+    __slots__ = ("guild_id", "user_id", "items",)
+
     def __init__(
             self,
             guild_id: int,
@@ -72,7 +197,7 @@ class UserItems(ItemInventory):
     @classmethod
     def from_rows(cls, rows: list[dict]) -> Self:
         items = [
-            Item(AnimalType[r["item"]], r["amount"])
+            Item(AnimalType.from_code(r["item"]), r["amount"])
             for r in rows
             if r["amount"] > 0
         ]
@@ -88,16 +213,8 @@ class UserItems(ItemInventory):
         Get a user's inventory from the database.
         """
 
-        rows = await conn.fetch(
-            """
-            SELECT
-                *
-            FROM
-                user_items
-            WHERE
-                guild_id = $1
-                AND owner_id = $2
-            """,
+        rows = await FETCH_USER_ITEMS.fetch(
+            conn,
             guild_id, user_id,
         )
         if not rows:
@@ -110,57 +227,95 @@ class PlotItems(ItemInventory):
     Items that a plot has.
     """
 
+    __slots__ = ("plot_id", "items",)
+
     def __init__(
             self,
-            plot_id: str | UUID,
+            plot_id: UUID,
             items: list[Item] | None = None):
-        self.plot_id = str(plot_id)
+        self.plot_id = plot_id
         self.items = items or []
 
     @classmethod
     def from_rows(cls, rows: list[dict]) -> Self:
         items = [
-            Item(AnimalType[r["item"]], r["amount"])
+            Item(AnimalType.from_code(r["item"]), r["amount"])
             for r in rows
         ]
         return cls(rows[0]["plot_id"], items)
 
     @classmethod
-    async def fetch(cls, conn: asyncpg.Connection, plot_id: str | UUID) -> Self:
+    async def fetch(cls, conn: asyncpg.Connection, plot_id: UUID) -> Self:
         """
-        Get a plot's inventory from the database.
+        Get a plot's inventory from the database, settling any production
+        that hasn't been written yet first.
         """
 
-        rows = await conn.fetch(
-            """
-            SELECT
-                *
-            FROM
-                plot_items
-            WHERE
-                plot_id = $1
-            """,
+        await settle_plot(conn, plot_id)
+        rows = await FETCH_PLOT_ITEMS.fetch(
+            conn,
             plot_id,
         )
         if not rows:
             return cls(plot_id)
         return cls.from_rows(rows)
 
+    @classmethod
+    async def fetch_many(
+            cls,
+            conn: asyncpg.Connection,
+            plot_ids: Iterable[UUID]) -> dict[UUID, Self]:
+        """
+        Get the inventories for any number of plots in a single query,
+        settling them all first. Plots with no items get an empty inventory.
+        """
+
+        plot_ids = list(plot_ids)
+        await settle_plots(conn, plot_ids)
+        rows = await FETCH_PLOTS_ITEMS.fetch(
+            conn,
+            plot_ids,
+        )
+        grouped: dict[UUID, list[dict]] = {i: [] for i in plot_ids}
+        for r in rows:
+            grouped[r["plot_id"]].append(r)
+        return {
+            i: cls.from_rows(r) if r else cls(i)
+            for i, r in grouped.items()
+        }
+
 
 class Inventory:
     """
     A class for all of the items that a user has.
+
+    Attributes
+    ----------
+    guild_id : int
+        The ID of the guild that the inventory is in.
+    user_id : int
+        The ID of the user that owns the inventory.
+    money : int
+        How much money the user has.
+    animal_count : int
+        How many animals the user has across all of their plots. This is
+        kept up to date by :meth:`Animal.save` and :meth:`Plot.delete`, and
+        isn't changed by :meth:`save`.
     """
 
+    __slots__ = ("guild_id", "user_id", "money", "animal_count",)
+
     def __init__(
             self,
             *,
             guild_id: int,
             user_id: int,
-            money: int = 0):
+            money: int = 0,
+            animal_count: int = 0):
         self.guild_id = guild_id
         self.user_id = user_id
         self.money = money
+        self.animal_count = animal_count
 
     @classmethod
     def from_row(cls, data) -> Self:
@@ -168,6 +323,7 @@ class Inventory:
             user_id=data["owner_id"],
             guild_id=data["guild_id"],
             money=data["money"],
+            animal_count=data["animal_count"],
         )
 
     @classmethod
@@ -180,16 +336,8 @@ class Inventory:
         Fetch an inventory instance from the databse.
         """
 
-        row = await conn.fetch(
-            """
-            SELECT
-                *
-            FROM
-                inventory
-            WHERE
-                guild_id = $1
-                AND owner_id = $2
-            """,
+        row = await FETCH_INVENTORY.fetch(
+            conn,
             guild_id, user_id,
         )
         if not row:
@@ -204,23 +352,209 @@ class Inventory:
         Save the current instance to the database
         """
 
-        row = await conn.fetch(
-            """
-            INSERT INTO
-                inventory
-                (
-                    guild_id,
-                    owner_id,
-                    money
-                )
-            VALUES
-                ($1, $2, $3)
-            ON CONFLICT
-                (guild_id, owner_id)
-            DO UPDATE SET
-                money = excluded.money
-            RETURNING *
-            """,
+        row = await SAVE_INVENTORY.fetch(
+            conn,
             self.guild_id, self.user_id, self.money,
         )
+        INVENTORY_CACHE.invalidate(self.guild_id, self.user_id)
         return self.from_row(row[0])
+
+
+class InventoryCache:
+    """
+    A bounded LRU cache of users' money and items, keyed by guild and user
+    ID, that every process keeps its own copy of.
+
+    Every write to ``inventory`` or ``user_items`` sends a notification on
+    ``INVENTORY_CHANNEL`` (see ``database.pgsql``), which drops the entry
+    from every process's cache once the write commits. The cache is only
+    used while :attr:`listener` is connected, and is emptied whenever it
+    connects or disconnects, as notifications may have been missed.
+
+    A load that an invalidation arrives during isn't cached, as it may have
+    read the rows from before the write. Each invalidation is given a
+    generation to tell when that's happened, and loads that started before
+    the oldest generation still being tracked are never cached.
+
+    Anything that spends money or items should still check the database in
+    the same transaction that it writes in.
+
+    Attributes
+    ----------
+    maxsize : int
+        The number of users to keep inventories cached for.
+    ttl : float
+        How long an entry is used for before it's fetched again, in case a
+        notification is lost.
+    listener : Listener | None
+        The listener for the invalidation channel, once :meth:`listen` has
+        been called.
+    listening : bool
+        Whether the cache is currently being kept coherent.
+    generation : int
+        The number of invalidations so far.
+    floor : int
+        Loads that started before this generation are never cached.
+    hits : int
+        The number of lookups that were served from the cache.
+    misses : int
+        The number of lookups that had to go to the database.
+    invalidations : int
+        The number of cached entries dropped because they were written to.
+    evictions : int
+        The number of entries dropped to make space.
+    discarded : int
+        The number of loads that weren't cached because of a write.
+    """
+
+    def __init__(
+            self,
+            maxsize: int = INVENTORY_CACHE_SIZE,
+            ttl: float = INVENTORY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[tuple[int, int], tuple[float, Inventory, UserItems]] = OrderedDict()
+        self.invalidated: OrderedDict[tuple[int, int], int] = OrderedDict()
+        self.listener: Listener | None = None
+        self.listening: bool = False
+        self.generation: int = 0
+        self.floor: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.invalidations: int = 0
+        self.evictions: int = 0
+        self.discarded: int = 0
+
+    async def listen(
+            self,
+            acquire: Callable[[], AsyncContextManager[asyncpg.Connection]]) -> bool:
+        """
+        Start listening for invalidations, or reconnect if the listener has
+        dropped. This should be called regularly.
+        """
+
+        if self.listener is None:
+            self.listener = Listener(
+                acquire,
+                INVENTORY_CHANNEL,
+                self.notified,
+                self.set_listening,
+            )
+        return await self.listener.ensure()
+
+    async def close(self) -> None:
+        """
+        Stop listening for invalidations, which stops the cache being used.
+        """
+
+        if self.listener is not None:
+            await self.listener.close()
+
+    def set_listening(self, listening: bool) -> None:
+        """
+        Empty the cache and turn it on or off.
+        """
+
+        self.listening = listening
+        self.entries.clear()
+        self.invalidated.clear()
+        self.generation += 1
+        self.floor = self.generation
+
+    def notified(self, payload: str) -> None:
+        guild_id, user_id = payload.split(" ")
+        self.invalidate(int(guild_id), int(user_id))
+
+    def get(self, guild_id: int, user_id: int) -> tuple[Inventory, UserItems] | None:
+        """
+        Get the cached money and items for a user, if there are any.
+        """
+
+        key = (guild_id, user_id)
+        cached = self.entries.get(key)
+        if cached is None or time.monotonic() - cached[0] >= self.ttl:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return cached[1], cached[2]
+
+    async def fetch(
+            self,
+            acquire: Callable[[], AsyncContextManager[asyncpg.Connection]],
+            guild_id: int,
+            user_id: int) -> tuple[Inventory, UserItems]:
+        """
+        Get the money and items for a user, from the cache if possible and
+        otherwise with a single query.
+        """
+
+        cached = self.get(guild_id, user_id)
+        if cached is not None:
+            return cached
+        generation = self.generation
+        async with acquire() as conn:
+            row = await FETCH_USER_INVENTORY.fetchrow(conn, guild_id, user_id)
+        assert row
+        inventory = Inventory(
+            guild_id=guild_id,
+            user_id=user_id,
+            money=row["money"],
+            animal_count=row["animal_count"],
+        )
+        items = UserItems(
+            guild_id,
+            user_id,
+            [
+                Item(AnimalType.from_code(i), a)
+                for i, a in zip(row["items"], row["amounts"])
+            ],
+        )
+
+        key = (guild_id, user_id)
+        if (
+                not self.listening
+                or generation < self.floor
+                or self.invalidated.get(key, 0) > generation):
+            self.discarded += 1
+            return inventory, items
+        self.entries[key] = (time.monotonic(), inventory, items)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return inventory, items
+
+    def invalidate(self, guild_id: int, user_id: int) -> None:
+        """
+        Drop the cached money and items for a user.
+        """
+
+        key = (guild_id, user_id)
+        self.generation += 1
+        self.invalidated[key] = self.generation
+        self.invalidated.move_to_end(key)
+        while len(self.invalidated) > self.maxsize:
+            _, generation = self.invalidated.popitem(last=False)
+            self.floor = max(self.floor, generation)
+        if self.entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Get the cache's counters.
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "discarded": self.discarded,
+        }
+
+
+INVENTORY_CACHE = InventoryCache()
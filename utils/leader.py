@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+from contextlib import AsyncExitStack
+from typing import TYPE_CHECKING, AsyncContextManager, Callable
+
+if TYPE_CHECKING:
+    import asyncpg
+
+__all__ = (
+    'PRODUCTION_LOCK_KEY',
+    'PRODUCTION_MEMBER_LOCK_KEY',
+    'Leader',
+)
+
+
+PRODUCTION_LOCK_KEY = 0x6661726d6572  # "farmer"
+PRODUCTION_MEMBER_LOCK_KEY = PRODUCTION_LOCK_KEY + 1
+
+
+class Leader:
+    """
+    Elects a single process out of many to do some work, using a
+    session-level Postgres advisory lock.
+
+    Every process keeps the connection that it checks on out of the pool,
+    holding a shared lock on ``member_key`` so that the leader can tell how
+    many processes there are. If the leader dies then its connection
+    closes, the lock is released, and the next process to check takes over.
+
+    Attributes
+    ----------
+    key : int
+        The advisory lock key that the leader holds.
+    member_key : int
+        The advisory lock key that every process holds a shared lock on.
+    conn : asyncpg.Connection | None
+        The connection holding the locks, if this process has checked in.
+    leading : bool
+        Whether this process was the leader when it last checked.
+    """
+
+    def __init__(
+            self,
+            acquire: Callable[[], AsyncContextManager[asyncpg.Connection]],
+            key: int = PRODUCTION_LOCK_KEY,
+            member_key: int = PRODUCTION_MEMBER_LOCK_KEY):
+        self.acquire = acquire
+        self.key = key
+        self.member_key = member_key
+        self.conn: asyncpg.Connection | None = None
+        self.stack: AsyncExitStack | None = None
+        self.leading: bool = False
+
+    async def join(self) -> asyncpg.Connection:
+        """
+        Get the connection that the locks are held on, taking one from the
+        pool and joining the members if the last one has dropped.
+        """
+
+        if self.conn is not None:
+            try:
+                if not self.conn.is_closed():
+                    return self.conn
+            except Exception:
+                pass  # Pooled connections that die are detached from the pool
+        await self.release()
+        self.stack = AsyncExitStack()
+        try:
+            conn = await self.stack.enter_async_context(self.acquire())
+            await conn.execute(
+                "SELECT PG_ADVISORY_LOCK_SHARED($1)",
+                self.member_key,
+            )
+        except BaseException:
+            await self.release()
+            raise
+        self.conn = conn
+        return conn
+
+    async def is_leader(self) -> bool:
+        """
+        Check that this process still holds the lock, trying to take it if
+        not. This is a single trivial query either way.
+        """
+
+        try:
+            conn = await self.join()
+            if self.leading:
+                self.leading = await conn.fetchval(
+                    """
+                    SELECT
+                        COUNT(*) > 0
+                    FROM
+                        pg_locks
+                    WHERE
+                        locktype = 'advisory'
+                        AND pid = PG_BACKEND_PID()
+                        AND ((classid::BIGINT << 32) | objid::BIGINT) = $1
+                        AND mode = 'ExclusiveLock'
+                        AND granted
+                    """,
+                    self.key,
+                )
+            if not self.leading:
+                self.leading = await conn.fetchval(
+                    "SELECT PG_TRY_ADVISORY_LOCK($1)",
+                    self.key,
+                )
+        except Exception:
+            await self.release()
+        return self.leading
+
+    async def count_members(self) -> int:
+        """
+        Get the number of processes that have checked in and are still
+        connected, including this one.
+        """
+
+        conn = await self.join()
+        return await conn.fetchval(
+            """
+            SELECT
+                COUNT(*)
+            FROM
+                pg_locks
+            WHERE
+                locktype = 'advisory'
+                AND database = (SELECT oid FROM pg_database WHERE datname = CURRENT_DATABASE())
+                AND ((classid::BIGINT << 32) | objid::BIGINT) = $1
+                AND mode = 'ShareLock'
+                AND granted
+            """,
+            self.member_key,
+        )
+
+    async def resign(self) -> None:
+        """
+        Give up the lock if it's held, so another process can take over
+        straight away, and leave the members.
+        """
+
+        if self.conn is not None and self.leading:
+            try:
+                await self.conn.execute(
+                    "SELECT PG_ADVISORY_UNLOCK($1)",
+                    self.key,
+                )
+            except Exception:
+                pass
+        await self.release()
+
+    async def release(self) -> None:
+        """
+        Put the locks' connection back into the pool, which releases them.
+        """
+
+        self.conn = None
+        self.leading = False
+        if self.stack is not None:
+            stack, self.stack = self.stack, None
+            try:
+                await stack.aclose()
+            except Exception:
+                pass
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from contextlib import AsyncExitStack
+from typing import TYPE_CHECKING, AsyncContextManager, Callable
+
+if TYPE_CHECKING:
+    import asyncpg
+
+__all__ = (
+    'Listener',
+)
+
+
+class Listener:
+    """
+    Keeps a connection out of the pool that LISTENs on a Postgres channel,
+    passing each notification's payload to a callback.
+
+    Notifications sent while nothing is listening are lost, so
+    ``on_listening`` is called with ``False`` as soon as the connection
+    drops and with ``True`` once it's listening again. Anything relying on
+    the notifications should throw away what it knows at both points.
+
+    Attributes
+    ----------
+    channel : str
+        The channel being listened to.
+    conn : asyncpg.Connection | None
+        The connection that is listening, if there is one.
+    """
+
+    def __init__(
+            self,
+            acquire: Callable[[], AsyncContextManager[asyncpg.Connection]],
+            channel: str,
+            on_notify: Callable[[str], None],
+            on_listening: Callable[[bool], None]):
+        self.acquire = acquire
+        self.channel = channel
+        self.on_notify = on_notify
+        self.on_listening = on_listening
+        self.conn: asyncpg.Connection | None = None
+        self.stack: AsyncExitStack | None = None
+
+    async def ensure(self) -> bool:
+        """
+        Make sure that the channel is being listened to, connecting again if
+        the last connection has dropped.
+        """
+
+        if self.conn is not None and not self.conn.is_closed():
+            return True
+        await self.close()
+
+        self.stack = AsyncExitStack()
+        try:
+            conn = await self.stack.enter_async_context(self.acquire())
+            await conn.add_listener(self.channel, self.notified)
+        except Exception:
+            await self.close()
+            return False
+        conn.add_termination_listener(self.terminated)
+        self.conn = conn
+        self.on_listening(True)
+        return True
+
+    def notified(
+            self,
+            conn: asyncpg.Connection,
+            pid: int,
+            channel: str,
+            payload: str) -> None:
+        self.on_notify(payload)
+
+    def terminated(self, conn: asyncpg.Connection) -> None:
+        if conn is self.conn:
+            self.conn = None
+            self.on_listening(False)
+
+    async def close(self) -> None:
+        """
+        Stop listening and put the connection back into the pool.
+        """
+
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            self.on_listening(False)
+            try:
+                conn.remove_termination_listener(self.terminated)
+                await conn.remove_listener(self.channel, self.notified)
+            except Exception:
+                pass
+        if self.stack is not None:
+            stack, self.stack = self.stack, None
+            try:
+                await stack.aclose()
+            except Exception:
+                pass
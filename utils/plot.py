@@ -1,12 +1,17 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Iterable, overload
+from collections import OrderedDict
+from typing import TYPE_CHECKING, ClassVar, Iterable, overload
 from typing_extensions import Self
 from uuid import uuid4
+import functools
+import os
 import random
 
 from .animal import Animal
 from .plot_type import PlotType
+from .production import AnimalTable
+from .statement import STATEMENTS
 
 if TYPE_CHECKING:
     from uuid import UUID
@@ -15,17 +20,285 @@ if TYPE_CHECKING:
 
 
 __all__ = (
+    'PlotCache',
     'Plot',
+    'PlotWithAnimals',
 )
 
 
+PLOT_CACHE_SIZE = int(os.getenv("FARMER_PLOT_CACHE_SIZE", 10_000))
+FENCE = "<:fence:1058304105644294154>"
+GROUND_TYPES: dict[PlotType, tuple[str, ...]] = {
+    PlotType.SKY: ("\N{CLOUD}",),
+    PlotType.LAKE: ("\N{WATER WAVE}",),
+}
+GRASS = (
+    "<:grass2:1058306471395328030>",
+    "<:grass3:1058307717124595792>",
+)
+
+FETCH_USER_PLOTS = STATEMENTS.register(
+    "fetch_user_plots",
+    """
+    SELECT
+        *
+    FROM
+        plots
+    WHERE
+        owner_id = $1
+        AND guild_id = $2
+    """,
+)
+
+SAVE_PLOT = STATEMENTS.register(
+    "save_plot",
+    """
+    INSERT INTO 
+        plots
+        (
+            id,
+            owner_id,
+            guild_id,
+            x,
+            y,
+            type
+        )
+    VALUES
+        (
+            $1,
+            $2,
+            $3,
+            $4,
+            $5,
+            $6
+        )
+    ON CONFLICT (id)
+    DO UPDATE
+    SET
+        owner_id = excluded.owner_id,
+        guild_id = excluded.guild_id,
+        x = excluded.x,
+        y = excluded.y,
+        type = excluded.type
+    RETURNING *
+    """,
+)
+
+DELETE_PLOT = STATEMENTS.register(
+    "delete_plot",
+    """
+    WITH deleted AS (
+        DELETE FROM
+            plots
+        WHERE
+            id = $1
+        RETURNING
+            id,
+            guild_id,
+            owner_id
+    ),
+    removed AS (
+        SELECT
+            deleted.guild_id,
+            deleted.owner_id,
+            animals.type,
+            COUNT(*) AS amount
+        FROM
+            animals
+            LEFT JOIN deleted ON animals.plot_id = deleted.id
+        WHERE
+            deleted.id IS NOT NULL
+        GROUP BY
+            deleted.guild_id,
+            deleted.owner_id,
+            animals.type
+    ),
+    owned AS (
+        UPDATE
+            inventory
+        SET
+            animal_count = inventory.animal_count - totals.amount
+        FROM
+            (
+                SELECT
+                    owner_id,
+                    guild_id,
+                    SUM(amount) AS amount
+                FROM
+                    removed
+                GROUP BY
+                    owner_id,
+                    guild_id
+            ) totals
+        WHERE
+            inventory.owner_id = totals.owner_id
+            AND inventory.guild_id = totals.guild_id
+    ),
+    counted AS (
+        UPDATE
+            animal_census
+        SET
+            count = animal_census.count - removed.amount
+        FROM
+            removed
+        WHERE
+            animal_census.guild_id = removed.guild_id
+            AND animal_census.type = removed.type
+        RETURNING
+            animal_census
+    )
+    SELECT
+        animal_census
+    FROM
+        counted
+    """,
+)
+
+FETCH_PLOT_VERSION = STATEMENTS.register(
+    "fetch_plot_version",
+    """
+    SELECT
+        version
+    FROM
+        plots
+    WHERE
+        id = $1
+    """,
+)
+
+FETCH_PLOT_ANIMALS = STATEMENTS.register(
+    "fetch_plot_animals",
+    """
+    SELECT
+        *
+    FROM
+        animals
+    WHERE
+        plot_id = $1
+    """,
+)
+
+FETCH_PLOTS_ANIMALS = STATEMENTS.register(
+    "fetch_plots_animals",
+    """
+    SELECT
+        *
+    FROM
+        animals
+    WHERE
+        plot_id = ANY($1::UUID[])
+    """,
+)
+
+
+@functools.lru_cache(maxsize=10_000)
+def get_ground(
+        plot_id: UUID,
+        plot_type: PlotType,
+        width: int,
+        height: int) -> tuple[str, ...]:
+    """
+    Get the ground tiles for a plot, row by row. This is seeded by the plot
+    ID so a plot always has the same ground.
+    """
+
+    r = random.Random(str(plot_id))
+    ground_type = GROUND_TYPES.get(plot_type, GRASS)
+    return tuple(r.choice(ground_type) for _ in range(width * height))
+
+
+class PlotCache:
+    """
+    A bounded LRU cache of every plot that a user owns, keyed by guild and
+    user ID.
+
+    Plots only change when they're saved, and each guild's interactions are
+    always handled by the same process, so :meth:`Plot.save` writing through
+    to the cache is enough to keep it correct. Saves inside a transaction
+    drop the user's entry instead, as the transaction could roll back.
+
+    Attributes
+    ----------
+    maxsize : int
+        The number of users to keep plots cached for.
+    hits : int
+        The number of lookups that were served from the cache.
+    misses : int
+        The number of lookups that had to go to the database.
+    evictions : int
+        The number of users whose plots were dropped to make space.
+    """
+
+    def __init__(self, maxsize: int = PLOT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.plots: OrderedDict[tuple[int, int], list[Plot]] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self, guild_id: int, user_id: int) -> list[Plot] | None:
+        """
+        Get the cached plots for a user, if there are any.
+        """
+
+        try:
+            plots = self.plots[(guild_id, user_id)]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.plots.move_to_end((guild_id, user_id))
+        self.hits += 1
+        return plots
+
+    def set(self, guild_id: int, user_id: int, plots: list[Plot]) -> None:
+        """
+        Cache every plot that a user owns.
+        """
+
+        self.plots[(guild_id, user_id)] = plots
+        self.plots.move_to_end((guild_id, user_id))
+        while len(self.plots) > self.maxsize:
+            self.plots.popitem(last=False)
+            self.evictions += 1
+
+    def update(self, plot: Plot) -> None:
+        """
+        Update a saved plot in the cache, if its owner's plots are cached.
+        """
+
+        plots = self.plots.get((plot.guild_id, plot.owner_id))
+        if plots is None:
+            return
+        plots[:] = [i for i in plots if i.id != plot.id]
+        plots.append(plot)
+
+    def invalidate(self, guild_id: int, user_id: int) -> None:
+        """
+        Drop the cached plots for a user.
+        """
+
+        self.plots.pop((guild_id, user_id), None)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Get the cache's counters.
+        """
+
+        return {
+            "size": len(self.plots),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
 class Plot:
     """
     A plot of land that contains animals.
 
     Attributes
     ----------
-    id : str
+    id : UUID
         The ID of the plot of land.
     owner_id : int
         The ID of the user that owns the plot of land.
@@ -35,17 +308,23 @@ class Plot:
         A two-item iterable of the XY coordinate for the plot.
     type : str
         The type of the plot of land.
+    cache : PlotCache
+        The cache used by :meth:`fetch_for_user`.
     """
 
+    __slots__ = ("id", "guild_id", "owner_id", "position", "type",)
+
+    cache: ClassVar[PlotCache] = PlotCache()
+
     def __init__(
             self,
             *,
-            id: str | UUID | None,
+            id: UUID | None,
             guild_id: int,
             owner_id: int,
             position: Iterable[int],
             type: PlotType) -> None:
-        self.id: str = str(id) if id is not None else str(uuid4())
+        self.id: UUID = id if id is not None else uuid4()
         self.guild_id: int = guild_id
         self.owner_id: int = owner_id
         self.position: tuple[int, int] = tuple(position)
@@ -61,8 +340,8 @@ class Plot:
             id=row["id"],
             owner_id=row["owner_id"],
             guild_id=row["guild_id"],
-            position=row["position"],
-            type=PlotType[row["type"]],
+            position=(row["x"], row["y"]),
+            type=PlotType.from_code(row["type"]),
         )
 
     @overload
@@ -93,39 +372,24 @@ class Plot:
             user_id: int,
             position: tuple[int, int] | None = None) -> list[Self] | Self | None:
         """
-        Get all of the plots that a user owns.
+        Get all of the plots that a user owns, or the one at the given
+        position. Plots are served from :attr:`cache` where possible.
         """
 
-        if position is None:
-            rows = await db.fetch(
-                """
-                SELECT
-                    *
-                FROM
-                    plots
-                WHERE
-                    owner_id = $1
-                    AND guild_id = $2
-                """,
+        plots = cls.cache.get(guild_id, user_id)
+        if plots is None:
+            rows = await FETCH_USER_PLOTS.fetch(
+                db,
                 user_id, guild_id,
             )
-            return [cls.from_row(i) for i in rows]
-
-        rows = await db.fetch(
-            """
-            SELECT
-                *
-            FROM
-                plots
-            WHERE
-                owner_id = $1
-                AND guild_id = $2
-                AND position = $3
-            """,
-            user_id, guild_id, position,
-        )
-        if rows:
-            return cls.from_row(rows[0])
+            plots = [cls.from_row(i) for i in rows]
+            cls.cache.set(guild_id, user_id, plots)
+
+        if position is None:
+            return list(plots)  # pyright: ignore
+        for p in plots:
+            if p.position == position:
+                return p  # pyright: ignore
         return None
 
     async def save(self, db: asyncpg.Connection) -> Self:
@@ -133,56 +397,54 @@ class Plot:
         Save the plot into the database.
         """
 
-        rows = await db.fetch(
-            """
-            INSERT INTO 
-                plots
-                (
-                    id,
-                    owner_id,
-                    guild_id,
-                    position,
-                    type
-                )
-            VALUES
-                (
-                    $1,
-                    $2,
-                    $3,
-                    $4,
-                    $5
-                )
-            ON CONFLICT (id)
-            DO UPDATE
-            SET
-                owner_id = excluded.owner_id,
-                guild_id = excluded.guild_id,
-                position = excluded.position,
-                type = excluded.type
-            RETURNING *
-            """,
+        rows = await SAVE_PLOT.fetch(
+            db,
             self.id,
             self.owner_id,
             self.guild_id,
-            self.position,
-            self.type.name,
+            *self.position,
+            self.type.code,
+        )
+        plot = self.from_row(rows[0])
+
+        # A save inside a transaction could still roll back, so the user's
+        # plots are read again next time instead
+        if db.is_in_transaction():
+            self.cache.invalidate(plot.guild_id, plot.owner_id)
+        else:
+            self.cache.update(plot)
+        return plot
+
+    async def delete(self, db: asyncpg.Connection) -> None:
+        """
+        Delete the plot along with its animals and items, taking its animals
+        out of the census for its guild and its owner's animal count.
+        """
+
+        rows = await DELETE_PLOT.fetch(db, self.id)
+        Animal.census.update(db, [r["animal_census"] for r in rows])
+        self.cache.invalidate(self.guild_id, self.owner_id)
+        if AnimalTable.current is not None:
+            AnimalTable.current.remove_plot(self.id)
+
+    async def fetch_version(self, db: asyncpg.Connection) -> int:
+        """
+        Get the plot's version, which changes whenever its items or animals
+        do.
+        """
+
+        return await FETCH_PLOT_VERSION.fetchval(
+            db,
+            self.id,
         )
-        return self.from_row(rows[0])
 
     async def fetch_animals(self, db: asyncpg.Connection) -> PlotWithAnimals:
         """
         Fetch the animals for the plot, storing them in an ``animals`` attr.
         """
 
-        rows = await db.fetch(
-            """
-            SELECT
-                *
-            FROM
-                animals
-            WHERE
-                plot_id = $1
-            """,
+        rows = await FETCH_PLOT_ANIMALS.fetch(
+            db,
             self.id,
         )
         animals = [Animal.from_row(i) for i in rows]
@@ -194,6 +456,8 @@ class PlotWithAnimals(Plot):
     A plot of land that has animals inside of it.
     """
 
+    __slots__ = ("animals",)
+
     animals: list[Animal]
 
     def __init__(self, *args, animals: list[Animal], **kwargs):
@@ -211,38 +475,48 @@ class PlotWithAnimals(Plot):
             **kwargs,
         )
 
-    def __str__(self) -> str:
-        r = random.Random(self.id)
-        ground_type: list[str]
-        if self.type == PlotType.SKY:
-            ground_type = ["\N{CLOUD}"]
-        elif self.type == PlotType.LAKE:
-            ground_type = ["\N{WATER WAVE}"]
-        else:
-            ground_type = [
-                "<:grass2:1058306471395328030>",
-                "<:grass3:1058307717124595792>",
-            ]
-        def make_row(r: random.Random, k: int = 5) -> list[str]:
-            return [
-                r.choice(ground_type)
-                for _ in range(k)
-            ]
-        rows = [
-            ["<:fence:1058304105644294154>"] * 5,
-            make_row(r),
-            make_row(r),
-            make_row(r),
-            make_row(r),
-            make_row(r),
+    @classmethod
+    async def fetch_many(
+            cls,
+            db: asyncpg.Connection,
+            plots: Iterable[Plot]) -> list[Self]:
+        """
+        Fetch the animals for any number of plots in a single query,
+        returning the plots with their animals in the order given.
+        """
+
+        plots = list(plots)
+        rows = await FETCH_PLOTS_ANIMALS.fetch(
+            db,
+            [p.id for p in plots],
+        )
+        animals: dict[UUID, list[Animal]] = {p.id: [] for p in plots}
+        for r in rows:
+            animals[r["plot_id"]].append(Animal.from_row(r))
+        return [
+            cls.from_plot(p, animals=animals[p.id])
+            for p in plots
         ]
-        assigned_plots: set[tuple[int, int]] = set()
-        to_add = self.animals.copy()
-        while to_add:
-            position: tuple[int, int] = tuple(random.choices(range(0, 5), k=2))  # pyright: ignore
-            if position in assigned_plots:
-                continue
-            animal = to_add.pop()
-            rows[position[0] + 1][position[1]] = animal.emoji
-            assigned_plots.add(position)
-        return "\n".join(["".join([c for c in r]) for r in rows])
+
+    def __str__(self) -> str:
+        return self.render()
+
+    def render(self, width: int = 5, height: int = 5) -> str:
+        """
+        Draw the plot as a fence over a grid of ground tiles with the plot's
+        animals on it.
+
+        Animals are placed by an RNG seeded with the plot and animal IDs, so
+        a plot looks the same every time it's drawn until its animals change.
+        """
+
+        tiles = list(get_ground(self.id, self.type, width, height))
+        animals = sorted(self.animals, key=lambda a: a.id)
+        r = random.Random(" ".join(str(i) for i in [self.id, *(a.id for a in animals)]))
+        cells = r.sample(range(width * height), k=min(len(animals), width * height))
+        for animal, cell in zip(animals, cells):
+            tiles[cell] = animal.emoji
+        return "\n".join([
+            FENCE * width,
+            *("".join(tiles[i:i + width]) for i in range(0, width * height, width)),
+        ])
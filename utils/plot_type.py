@@ -8,6 +8,7 @@ import novus
 __all__ = (
     'PlotBase',
     'PlotType',
+    'PLOT_TYPE_CODES',
 )
 
 
@@ -42,3 +43,31 @@ class PlotType(Enum):
 
     if TYPE_CHECKING:
         value: PlotBase
+
+    @property
+    def code(self) -> int:
+        """
+        The code that the plot type is stored as in the database.
+        """
+
+        return PLOT_TYPE_CODES[self]
+
+    @classmethod
+    def from_code(cls, code: int) -> PlotType:
+        """
+        Get a plot type from the code that it's stored as in the database.
+        """
+
+        return PLOT_TYPES_BY_CODE[code]
+
+
+# The code each plot type is stored as in the database. Codes must never be
+# changed or reused - new plot types take the next unused code.
+# Must match the migration in database.pgsql.
+PLOT_TYPE_CODES: dict[PlotType, int] = {
+    PlotType.FARM: 1,
+    PlotType.GARDEN: 2,
+    PlotType.LAKE: 3,
+    PlotType.SKY: 4,
+}
+PLOT_TYPES_BY_CODE = {v: k for k, v in PLOT_TYPE_CODES.items()}
@@ -0,0 +1,1038 @@
+from __future__ import annotations
+
+from enum import Enum
+from typing import TYPE_CHECKING, AsyncContextManager, Callable, ClassVar, Iterable, NamedTuple
+from typing_extensions import Self
+from uuid import UUID
+import asyncio
+import math
+import os
+import time
+
+import numpy as np
+
+from .animal_type import AnimalType
+from .statement import MAINTENANCE_STATEMENTS, STATEMENTS
+
+if TYPE_CHECKING:
+    import asyncpg
+
+    from .animal import Animal
+
+__all__ = (
+    'PLOT_ITEM_CAPACITY',
+    'PRODUCTION_PERIOD',
+    'PRODUCTION_TICK_INTERVAL',
+    'ProductionMode',
+    'PRODUCTION_MODE',
+    'PRODUCTION_SHARDS',
+    'PRODUCTION_CONCURRENCY',
+    'PRODUCTION_FLUSH_INTERVAL',
+    'PRODUCTION_CHUNK_SIZE',
+    'ProductionResult',
+    'ShardResult',
+    'get_shard_bounds',
+    'AnimalTable',
+    'ScheduledAnimalTable',
+    'produce_items',
+    'produce_items_chunked',
+    'produce_items_sharded',
+    'run_production_tick',
+    'settle_plot',
+    'settle_plots',
+    'settle_lazy_plot',
+    'settle_lazy_plots',
+)
+
+
+PLOT_ITEM_CAPACITY = 100
+PRODUCTION_PERIOD = 30 * 60  # An animal produces every PERIOD * rate seconds
+PRODUCTION_TICK_INTERVAL = 60  # Seconds between production ticks
+ANIMAL_TYPES = list(AnimalType)
+ANIMAL_TYPE_INDEX = {t: i for i, t in enumerate(ANIMAL_TYPES)}
+
+
+class ProductionMode(Enum):
+    """
+    How items are produced by animals.
+
+    ``TICK`` has every lucky animal produce an item once a minute in a global
+    loop. ``LAZY`` stores when each plot was last settled and works out
+    what was produced since then whenever the plot is looked at.
+    ``RESIDENT`` runs the same loop as ``TICK`` against an in-memory
+    :class:`AnimalTable`, writing produced items back in batches.
+    ``SCHEDULED`` keeps the same in-memory table but only wakes the animals
+    whose next item is due, using a :class:`ScheduledAnimalTable`.
+    """
+
+    TICK = "tick"
+    LAZY = "lazy"
+    RESIDENT = "resident"
+    SCHEDULED = "scheduled"
+
+
+PRODUCTION_MODE = ProductionMode(os.getenv("FARMER_PRODUCTION_MODE", "tick"))
+PRODUCTION_SHARDS = int(os.getenv("FARMER_PRODUCTION_SHARDS", 1))
+PRODUCTION_CONCURRENCY = int(os.getenv("FARMER_PRODUCTION_CONCURRENCY", 1))
+PRODUCTION_FLUSH_INTERVAL = int(os.getenv("FARMER_PRODUCTION_FLUSH_INTERVAL", 300))
+PRODUCTION_CHUNK_SIZE = int(os.getenv("FARMER_PRODUCTION_CHUNK_SIZE", 0))
+
+
+class ProductionResult(NamedTuple):
+    """
+    The outcome of a single production tick.
+
+    Attributes
+    ----------
+    rows : int
+        The number of ``plot_items`` rows that were inserted or updated.
+    items : int
+        The total number of items that were produced.
+    """
+
+    rows: int
+    items: int
+
+    @classmethod
+    def total(cls, shards: Iterable[ShardResult]) -> Self:
+        """
+        Add up what a set of shards produced.
+        """
+
+        shards = list(shards)
+        return cls(
+            sum(s.result.rows for s in shards),
+            sum(s.result.items for s in shards),
+        )
+
+
+class ShardResult(NamedTuple):
+    """
+    The outcome of a production tick for a single shard of plots.
+
+    Attributes
+    ----------
+    shard : int
+        The index of the shard.
+    result : ProductionResult
+        What the shard produced.
+    duration : float
+        How long the shard took to run, in seconds.
+    """
+
+    shard: int
+    result: ProductionResult
+    duration: float
+
+
+def get_shard_bounds(shard: int, shard_count: int) -> tuple[UUID, UUID]:
+    """
+    Get the first and last plot IDs in a shard. Plot IDs are random, so
+    splitting the ID space evenly splits the plots evenly, however they're
+    spread across guilds.
+    """
+
+    start = shard * 2 ** 128 // shard_count
+    end = (shard + 1) * 2 ** 128 // shard_count - 1
+    return UUID(int=start), UUID(int=end)
+
+
+# The CTEs that write a ``producers`` CTE of ``(plot_id, item, amount)``
+# into plots that aren't full. Full plots are found through the partial
+# ``plots_full_idx`` index, so the capacity is written in as a literal to
+# match its predicate.
+DEPOSITS = f"""
+    full_plots AS (
+        SELECT
+            id
+        FROM
+            plots
+        WHERE
+            item_count >= {PLOT_ITEM_CAPACITY}
+    ),
+    deposits AS (
+        SELECT
+            *
+        FROM
+            producers
+        WHERE
+            plot_id NOT IN (SELECT id FROM full_plots)
+    ),
+    counted AS (
+        UPDATE
+            plots
+        SET
+            item_count = plots.item_count + deposited.amount,
+            version = plots.version + 1
+        FROM
+            (
+                SELECT
+                    plot_id,
+                    SUM(amount) AS amount
+                FROM
+                    deposits
+                GROUP BY
+                    plot_id
+            ) deposited
+        WHERE
+            plots.id = deposited.plot_id
+    ),
+    written AS (
+        INSERT INTO
+            plot_items
+            (
+                plot_id,
+                item,
+                amount
+            )
+        SELECT
+            plot_id,
+            item,
+            amount
+        FROM
+            deposits
+        ON CONFLICT
+            (plot_id, item)
+        DO UPDATE
+        SET
+            amount = plot_items.amount + excluded.amount
+        RETURNING
+            plot_id,
+            item
+    )
+"""
+
+# The end of a production statement, given a ``producers`` CTE
+DEPOSIT_PRODUCERS = DEPOSITS + """
+    SELECT
+        COUNT(*) AS rows,
+        COALESCE(SUM(deposits.amount), 0) AS items
+    FROM
+        written
+        LEFT JOIN deposits USING (plot_id, item)
+"""
+
+SETTLE_LAZY_PLOTS = STATEMENTS.register(
+    "settle_lazy_plots",
+    """
+    WITH previous AS (
+        SELECT
+            id,
+            settled_at,
+            item_count
+        FROM
+            plots
+        WHERE
+            id = ANY($1::UUID[])
+            AND settled_at < NOW()
+        ORDER BY
+            id
+        FOR UPDATE
+    ),
+    produced AS (
+        SELECT
+            animals.plot_id,
+            animals.type AS item,
+            SUM(
+                FLOOR(EXTRACT(EPOCH FROM NOW()) / ($2 * animals.production_rate))
+                - FLOOR(EXTRACT(EPOCH FROM previous.settled_at) / ($2 * animals.production_rate))
+            )::INTEGER AS amount
+        FROM
+            animals
+            LEFT JOIN previous ON animals.plot_id = previous.id
+        WHERE
+            previous.id IS NOT NULL
+            AND animals.production_rate > 0
+        GROUP BY
+            animals.plot_id,
+            animals.type
+    ),
+    capped AS (
+        SELECT
+            produced.plot_id,
+            produced.item,
+            LEAST(
+                produced.amount,
+                $3 - previous.item_count
+                - SUM(produced.amount) OVER (
+                    PARTITION BY produced.plot_id
+                    ORDER BY produced.item
+                )
+                + produced.amount
+            ) AS amount
+        FROM
+            produced
+            LEFT JOIN previous ON produced.plot_id = previous.id
+    ),
+    deposits AS (
+        SELECT
+            *
+        FROM
+            capped
+        WHERE
+            amount > 0
+    ),
+    settled AS (
+        UPDATE
+            plots
+        SET
+            settled_at = NOW(),
+            item_count = plots.item_count + COALESCE(deposited.amount, 0),
+            version = plots.version + (deposited.amount IS NOT NULL)::INTEGER
+        FROM
+            previous
+            LEFT JOIN (
+                SELECT
+                    plot_id,
+                    SUM(amount) AS amount
+                FROM
+                    deposits
+                GROUP BY
+                    plot_id
+            ) deposited ON deposited.plot_id = previous.id
+        WHERE
+            plots.id = previous.id
+    ),
+    written AS (
+        INSERT INTO
+            plot_items
+            (
+                plot_id,
+                item,
+                amount
+            )
+        SELECT
+            plot_id,
+            item,
+            amount
+        FROM
+            deposits
+        ON CONFLICT
+            (plot_id, item)
+        DO UPDATE
+        SET
+            amount = plot_items.amount + excluded.amount
+    )
+    SELECT
+        COALESCE(SUM(amount), 0)
+    FROM
+        deposits
+    """,
+)
+
+FETCH_STALE_ANIMALS = MAINTENANCE_STATEMENTS.register(
+    "fetch_stale_animals",
+    """
+    SELECT
+        id,
+        plot_id,
+        type,
+        production_rate
+    FROM
+        animals
+    WHERE
+        plot_id = ANY($1::UUID[])
+    """,
+)
+
+FLUSH_PENDING_ITEMS = MAINTENANCE_STATEMENTS.register(
+    "flush_pending_items",
+    """
+    WITH deposits AS (
+        SELECT
+            *
+        FROM
+            UNNEST($1::UUID[], $2::SMALLINT[], $3::INTEGER[])
+            AS d (plot_id, item, amount)
+    ),
+    counted AS (
+        UPDATE
+            plots
+        SET
+            item_count = plots.item_count + deposited.amount,
+            version = plots.version + 1
+        FROM
+            (
+                SELECT
+                    plot_id,
+                    SUM(amount) AS amount
+                FROM
+                    deposits
+                GROUP BY
+                    plot_id
+            ) deposited
+        WHERE
+            plots.id = deposited.plot_id
+    )
+    INSERT INTO
+        plot_items
+        (
+            plot_id,
+            item,
+            amount
+        )
+    SELECT
+        *
+    FROM
+        deposits
+    ON CONFLICT
+        (plot_id, item)
+    DO UPDATE
+    SET
+        amount = plot_items.amount + excluded.amount
+    """,
+)
+
+
+async def produce_items(
+        conn: asyncpg.Connection,
+        random_key: float,
+        shard: int = 0,
+        shard_count: int = 1,
+        chunk_size: int = PRODUCTION_CHUNK_SIZE) -> ProductionResult:
+    """
+    Make every animal whose production rate is at least ``random_key``
+    produce an item inside of its plot.
+
+    The whole tick runs as a single statement: producing animals are
+    collapsed into one row per ``(plot_id, item)``, plots that are already at
+    capacity are skipped, and the remainder are upserted into
+    ``plot_items``.
+
+    Only the plots whose IDs fall into ``shard`` out of ``shard_count``
+    are produced for. The shard is a range of plot IDs, so each shard reads
+    its own part of ``animals_plot_id_production_idx`` without touching
+    ``plots``.
+
+    If ``chunk_size`` is set then the tick is instead run as a series of
+    statements that each produce for at most ``chunk_size`` ``(plot_id,
+    item)`` rows, so that no statement holds its locks for the whole tick.
+    """
+
+    if chunk_size:
+        return await produce_items_chunked(
+            conn,
+            random_key,
+            shard,
+            shard_count,
+            chunk_size,
+        )
+    row = await conn.fetchrow(
+        """
+        WITH producers AS (
+            SELECT
+                plot_id,
+                type AS item,
+                COUNT(*)::INTEGER AS amount
+            FROM
+                animals
+            WHERE
+                production_rate >= $1
+                AND plot_id BETWEEN $2 AND $3
+            GROUP BY
+                plot_id,
+                type
+        ),
+        """ + DEPOSIT_PRODUCERS,
+        random_key, *get_shard_bounds(shard, shard_count),
+    )
+    assert row
+    return ProductionResult(row["rows"], row["items"])
+
+
+async def produce_items_chunked(
+        conn: asyncpg.Connection,
+        random_key: float,
+        shard: int,
+        shard_count: int,
+        chunk_size: int) -> ProductionResult:
+    """
+    Run a production tick in chunks of ``chunk_size`` ``(plot_id, item)``
+    rows, in plot ID order. Each chunk produces and writes its items in one
+    statement that commits on its own, so the locks it takes on
+    ``plot_items`` and ``plots`` are only held for that chunk, and nothing
+    comes back to Python but the key to carry on from.
+
+    A plot that fills up part way through a tick is skipped for the rest of
+    it.
+    """
+
+    start, end = get_shard_bounds(shard, shard_count)
+    last_plot_id, last_item = start, 0  # Type codes start from 1
+    rows, items = 0, 0
+    while True:
+        row = await conn.fetchrow(
+            """
+            WITH producers AS (
+                SELECT
+                    plot_id,
+                    type AS item,
+                    COUNT(*)::INTEGER AS amount
+                FROM
+                    animals
+                WHERE
+                    production_rate >= $1
+                    AND plot_id BETWEEN $2 AND $3
+                    AND (plot_id, type) > ($2, $4)
+                GROUP BY
+                    plot_id,
+                    type
+                ORDER BY
+                    plot_id,
+                    type
+                LIMIT
+                    $5
+            ),
+            """ + DEPOSITS + """
+            SELECT
+                (SELECT COUNT(*) FROM written) AS rows,
+                (SELECT COALESCE(SUM(amount), 0) FROM deposits) AS items,
+                (SELECT COUNT(*) FROM producers) AS producers,
+                last.plot_id,
+                last.item
+            FROM
+                (
+                    SELECT
+                        plot_id,
+                        item
+                    FROM
+                        producers
+                    ORDER BY
+                        plot_id DESC,
+                        item DESC
+                    LIMIT
+                        1
+                ) last
+            """,
+            random_key, last_plot_id, end, last_item, chunk_size,
+        )
+        if row is None:
+            break
+        rows += row["rows"]
+        items += row["items"]
+        if row["producers"] < chunk_size:
+            break
+        last_plot_id, last_item = row["plot_id"], row["item"]
+    return ProductionResult(rows, items)
+
+
+async def produce_items_sharded(
+        acquire: Callable[[], AsyncContextManager[asyncpg.Connection]],
+        random_key: float,
+        *,
+        shards: int = PRODUCTION_SHARDS,
+        concurrency: int = PRODUCTION_CONCURRENCY) -> list[ShardResult]:
+    """
+    Run a production tick split into ``shards`` ranges of plot IDs, with up
+    to ``concurrency`` shards running at once, each on its own connection
+    from ``acquire``.
+
+    Shards never share a plot, so they don't contend on any rows.
+    """
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(shard: int) -> ShardResult:
+        async with semaphore, acquire() as conn:
+            start = time.perf_counter()
+            result = await produce_items(conn, random_key, shard, shards)
+            return ShardResult(shard, result, time.perf_counter() - start)
+
+    return await asyncio.gather(*[run(i) for i in range(shards)])
+
+
+async def run_production_tick(
+        acquire: Callable[[], AsyncContextManager[asyncpg.Connection]],
+        random_key: float,
+        *,
+        now: float | None = None,
+        shards: int = PRODUCTION_SHARDS,
+        concurrency: int = PRODUCTION_CONCURRENCY) -> list[ShardResult]:
+    """
+    Run a single production tick against whichever animals are in use.
+
+    If a resident animal table is loaded then any stale plots are read
+    again, and its animals produce into its pending counters, which are
+    left for the caller to flush. The result is given as a single shard. Scheduled tables run every tick up
+    to ``now``. Otherwise the tick is run in the database with
+    :func:`produce_items_sharded`.
+    """
+
+    table = AnimalTable.current
+    if table is None:
+        return await produce_items_sharded(
+            acquire,
+            random_key,
+            shards=shards,
+            concurrency=concurrency,
+        )
+    start = time.perf_counter()
+    if table.stale:
+        async with acquire() as conn:
+            await table.refresh(conn)
+    if isinstance(table, ScheduledAnimalTable):
+        result = table.produce_due(now)
+    else:
+        result = table.produce(random_key)
+    return [ShardResult(0, result, time.perf_counter() - start)]
+
+
+async def settle_plot(
+        conn: asyncpg.Connection,
+        plot_id: UUID) -> None:
+    """
+    Make sure that a plot's items in the database are up to date before
+    they're read or claimed.
+    """
+
+    await settle_plots(conn, [plot_id])
+
+
+async def settle_plots(
+        conn: asyncpg.Connection,
+        plot_ids: Iterable[UUID]) -> None:
+    """
+    Make sure that the items in the database for a set of plots are up to
+    date before they're read or claimed. This is at most one query however
+    many plots there are.
+    """
+
+    if PRODUCTION_MODE == ProductionMode.LAZY:
+        await settle_lazy_plots(conn, plot_ids)
+    elif AnimalTable.current is not None:
+        await AnimalTable.current.flush(conn, plot_ids)
+
+
+async def settle_lazy_plot(
+        conn: asyncpg.Connection,
+        plot_id: UUID) -> int:
+    """
+    Add everything that a plot's animals have produced since it was last
+    settled to its items, and mark it as settled now. Returns the number of
+    items that were added.
+    """
+
+    return await settle_lazy_plots(conn, [plot_id])
+
+
+async def settle_lazy_plots(
+        conn: asyncpg.Connection,
+        plot_ids: Iterable[UUID]) -> int:
+    """
+    Add everything that the animals in a set of plots have produced since
+    each plot was last settled to its items, and mark them as settled now.
+    Returns the number of items that were added.
+
+    Each animal produces an item every ``PRODUCTION_PERIOD * production_rate``
+    seconds, counted from the epoch, so how often a plot is settled never
+    changes how much it produces. Items that would take a plot past its
+    capacity are dropped.
+    """
+
+    produced = await SETTLE_LAZY_PLOTS.fetchval(
+        conn,
+        list(plot_ids), PRODUCTION_PERIOD, PLOT_ITEM_CAPACITY,
+    )
+    return produced
+
+
+class AnimalTable:
+    """
+    Every animal's plot, item and production rate held in memory as NumPy
+    arrays, along with the items that have been produced but not yet written
+    to the database.
+
+    Attributes
+    ----------
+    current : AnimalTable | None
+        The table that is currently in use, if resident production is
+        enabled. :meth:`Animal.save` keeps this up to date.
+    plot_ids : list[UUID]
+        The ID of each plot, indexed by plot number.
+    animal_ids : list[UUID | None]
+        The ID of each animal, or ``None`` where the animal has been removed
+        and its index is free.
+    plots : numpy.ndarray
+        The plot number of each animal.
+    items : numpy.ndarray
+        The index into ``AnimalType`` of each animal.
+    rates : numpy.ndarray
+        The production rate of each animal, which is negative for removed
+        animals so that they never produce.
+    totals : numpy.ndarray
+        The number of items in each plot, including unflushed items.
+    pending : numpy.ndarray
+        Unflushed items, indexed by ``plot * len(AnimalType) + item``.
+    stale : set[UUID]
+        Plots whose animals were changed inside a transaction, which could
+        still roll back, so they're read again before the next tick.
+    """
+
+    current: ClassVar[AnimalTable | None] = None
+
+    def __init__(self) -> None:
+        self.size: int = 0
+        self.animal_index: dict[UUID, int] = {}
+        self.animal_ids: list[UUID | None] = []
+        self.free: list[int] = []
+        self.plot_ids: list[UUID] = []
+        self.plot_index: dict[UUID, int] = {}
+        self.plots = np.zeros(0, dtype=np.int32)
+        self.items = np.zeros(0, dtype=np.int16)
+        self.rates = np.zeros(0, dtype=np.float64)
+        self.totals = np.zeros(0, dtype=np.int32)
+        self.pending = np.zeros(0, dtype=np.int32)
+        self.stale: set[UUID] = set()
+
+    @classmethod
+    async def load(cls, conn: asyncpg.Connection) -> Self:
+        """
+        Build a table from every animal and plot item in the database,
+        streaming animals through a cursor rather than loading them all at
+        once.
+        """
+
+        table = cls()
+        async with conn.transaction():
+            async for row in conn.cursor(
+                    """
+                    SELECT
+                        id,
+                        plot_id,
+                        type,
+                        production_rate
+                    FROM
+                        animals
+                    """,
+                    prefetch=PRODUCTION_CHUNK_SIZE or 10_000):
+                table.set(
+                    row["id"],
+                    row["plot_id"],
+                    AnimalType.from_code(row["type"]),
+                    row["production_rate"],
+                )
+        for row in await conn.fetch(
+                """
+                SELECT
+                    id,
+                    item_count
+                FROM
+                    plots
+                WHERE
+                    item_count > 0
+                """):
+            plot = table.get_plot(row["id"])
+            table.totals[plot] = row["item_count"]
+        return table
+
+    def get_plot(self, plot_id: UUID) -> int:
+        """
+        Get the number of a plot, adding it to the table if it's new.
+        """
+
+        try:
+            return self.plot_index[plot_id]
+        except KeyError:
+            pass
+        plot = len(self.plot_ids)
+        self.plot_ids.append(plot_id)
+        self.plot_index[plot_id] = plot
+        if plot >= len(self.totals):
+            capacity = max(plot * 2, 1024)
+            self.totals = np.resize(self.totals, capacity)
+            self.totals[plot:] = 0
+            self.pending = np.resize(self.pending, capacity * len(ANIMAL_TYPES))
+            self.pending[plot * len(ANIMAL_TYPES):] = 0
+        return plot
+
+    def set(
+            self,
+            animal_id: UUID,
+            plot_id: UUID,
+            type: AnimalType,
+            production_rate: float) -> None:
+        """
+        Add or update a single animal.
+        """
+
+        index = self.animal_index.get(animal_id)
+        if index is None and self.free:
+            index = self.free.pop()
+            self.animal_ids[index] = animal_id
+            self.animal_index[animal_id] = index
+        elif index is None:
+            index = self.size
+            if index >= len(self.rates):
+                capacity = max(index * 2, 1024)
+                self.plots = np.resize(self.plots, capacity)
+                self.items = np.resize(self.items, capacity)
+                self.rates = np.resize(self.rates, capacity)
+            self.animal_ids.append(animal_id)
+            self.animal_index[animal_id] = index
+            self.size += 1
+        self.plots[index] = self.get_plot(plot_id)
+        self.items[index] = ANIMAL_TYPE_INDEX[type]
+        self.rates[index] = production_rate
+
+    def update(self, animal: Animal) -> None:
+        """
+        Add or update an animal after it's been saved.
+        """
+
+        self.set(animal.id, animal.plot_id, animal.type, animal.production_rate)
+
+    def invalidate_plot(self, plot_id: UUID) -> None:
+        """
+        Mark a plot's animals to be read again before the next tick.
+        """
+
+        self.stale.add(plot_id)
+
+    async def refresh(self, conn: asyncpg.Connection) -> None:
+        """
+        Read the animals of every stale plot again, adding the ones that
+        are new and removing the ones that are gone. Animals that are still
+        there are left as they are.
+        """
+
+        if not self.stale:
+            return
+        plot_ids, self.stale = list(self.stale), set()
+        try:
+            rows = await FETCH_STALE_ANIMALS.fetch(conn, plot_ids)
+        except BaseException:
+            self.stale.update(plot_ids)
+            raise
+        animal_ids = {r["id"] for r in rows}
+        plots = [self.plot_index[i] for i in plot_ids if i in self.plot_index]
+        for index in np.flatnonzero(np.isin(self.plots[:self.size], plots)).tolist():
+            if self.animal_ids[index] not in animal_ids:
+                self.remove(index)
+        for row in rows:
+            if row["id"] not in self.animal_index:
+                self.set(
+                    row["id"],
+                    row["plot_id"],
+                    AnimalType.from_code(row["type"]),
+                    row["production_rate"],
+                )
+
+    def remove(self, index: int) -> None:
+        """
+        Remove the animal at an index, leaving the index free to be reused.
+        """
+
+        animal_id = self.animal_ids[index]
+        if animal_id is None:
+            return
+        del self.animal_index[animal_id]
+        self.animal_ids[index] = None
+        self.rates[index] = -1
+        self.free.append(index)
+
+    def produce(self, random_key: float) -> ProductionResult:
+        """
+        Make every animal whose production rate is at least ``random_key``
+        produce an item into the pending counters, skipping plots that are
+        already at capacity.
+        """
+
+        return self.produce_from(
+            np.flatnonzero(self.rates[:self.size] >= random_key),
+        )
+
+    def produce_from(self, animals: np.ndarray) -> ProductionResult:
+        """
+        Make the animals at the given indexes produce an item into the
+        pending counters, skipping plots that are already at capacity.
+        """
+
+        plots = self.plots[animals]
+        producing = self.totals[plots] < PLOT_ITEM_CAPACITY
+        keys = (
+            plots[producing].astype(np.int64) * len(ANIMAL_TYPES)
+            + self.items[animals][producing]
+        )
+        keys, counts = np.unique(keys, return_counts=True)
+        self.pending[keys] += counts.astype(np.int32)
+        np.add.at(self.totals, keys // len(ANIMAL_TYPES), counts.astype(np.int32))
+        return ProductionResult(len(keys), int(counts.sum()))
+
+    async def flush(
+            self,
+            conn: asyncpg.Connection,
+            plot_ids: Iterable[UUID] | None = None) -> int:
+        """
+        Write pending items into the database in a single statement, either
+        for every plot or just for the given plots. Returns the number of
+        rows written.
+
+        The items are taken out of the table once the statement succeeds, so
+        this can't run inside a transaction; a rollback would lose them.
+        """
+
+        if conn.is_in_transaction():
+            raise RuntimeError("Pending items can't be flushed inside a transaction")
+        if plot_ids is None:
+            keys = np.flatnonzero(self.pending)
+        else:
+            plots = np.array(
+                [
+                    self.plot_index[i]
+                    for i in plot_ids
+                    if i in self.plot_index
+                ],
+                dtype=np.int64,
+            )
+            keys = (
+                plots[:, None] * len(ANIMAL_TYPES)
+                + np.arange(len(ANIMAL_TYPES))
+            ).ravel()
+            keys = keys[self.pending[keys] > 0]
+        if not len(keys):
+            return 0
+        amounts = self.pending[keys]
+        self.pending[keys] = 0
+        try:
+            await FLUSH_PENDING_ITEMS.execute(
+                conn,
+                [self.plot_ids[k] for k in keys // len(ANIMAL_TYPES)],
+                [ANIMAL_TYPES[k].code for k in keys % len(ANIMAL_TYPES)],
+                amounts.tolist(),
+            )
+        except BaseException:
+            self.pending[keys] += amounts
+            raise
+        return len(keys)
+
+    def clear_plot(self, plot_id: UUID, amount: int) -> None:
+        """
+        Take items that have been claimed out of a plot's total. Taking out
+        the amount that was claimed, rather than setting the total to what's
+        pending, stays right however the claim and a flush interleave.
+        """
+
+        plot = self.plot_index.get(plot_id)
+        if plot is not None:
+            self.totals[plot] = max(self.totals[plot] - amount, 0)
+
+    def remove_plot(self, plot_id: UUID) -> None:
+        """
+        Remove a plot that's been deleted along with its animals, dropping
+        any of its items that haven't been written yet.
+        """
+
+        plot = self.plot_index.pop(plot_id, None)
+        if plot is None:
+            return
+        start = plot * len(ANIMAL_TYPES)
+        self.pending[start:start + len(ANIMAL_TYPES)] = 0
+        self.totals[plot] = 0
+        for index in np.flatnonzero(self.plots[:self.size] == plot).tolist():
+            self.remove(index)
+
+
+class ScheduledAnimalTable(AnimalTable):
+    """
+    An :class:`AnimalTable` that gives every animal a deadline for its next
+    item, following the README's 30*N minute period, and keeps them in a
+    hashed timer wheel. A tick only looks at the animals in the current slot
+    of the wheel rather than at every animal.
+
+    Deadlines are counted from the epoch in the same way as
+    :func:`settle_lazy_plot`.
+
+    Attributes
+    ----------
+    deadlines : numpy.ndarray
+        The time at which each animal will next produce an item.
+    wheel : list[set[int]]
+        The indexes of the animals that are due in each tick, modulo
+        ``WHEEL_SIZE``.
+    tick : int
+        The last tick that was run.
+    """
+
+    TICK_LENGTH: ClassVar[int] = PRODUCTION_TICK_INTERVAL
+    WHEEL_SIZE: ClassVar[int] = 64
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.deadlines = np.zeros(0, dtype=np.float64)
+        self.wheel: list[set[int]] = [set() for _ in range(self.WHEEL_SIZE)]
+        self.tick: int = int(time.time() // self.TICK_LENGTH)
+
+    def get_period(self, production_rate: float) -> float:
+        """
+        Get the number of seconds between an animal's items, never less than
+        one tick.
+        """
+
+        return max(PRODUCTION_PERIOD * production_rate, self.TICK_LENGTH)
+
+    def schedule(self, index: int) -> None:
+        """
+        Put an animal into the wheel slot for its deadline, or the next
+        tick if that slot has already been run.
+        """
+
+        tick = max(int(self.deadlines[index] // self.TICK_LENGTH), self.tick + 1)
+        self.wheel[tick % self.WHEEL_SIZE].add(index)
+
+    def set(
+            self,
+            animal_id: UUID,
+            plot_id: UUID,
+            type: AnimalType,
+            production_rate: float) -> None:
+        super().set(animal_id, plot_id, type, production_rate)
+        index = self.animal_index[animal_id]
+        if index >= len(self.deadlines):
+            self.deadlines = np.resize(self.deadlines, len(self.rates))
+        period = self.get_period(production_rate)
+        self.deadlines[index] = (math.floor(time.time() / period) + 1) * period
+        self.schedule(index)
+
+    def remove(self, index: int) -> None:
+        super().remove(index)
+        for slot in self.wheel:
+            slot.discard(index)
+
+    def produce_due(self, now: float | None = None) -> ProductionResult:
+        """
+        Run every tick up to ``now``, making the animals that are due produce
+        an item and scheduling their next one.
+        """
+
+        now_tick = int((time.time() if now is None else now) // self.TICK_LENGTH)
+        rows, items = 0, 0
+        while self.tick < now_tick:
+            self.tick += 1
+            slot = self.wheel[self.tick % self.WHEEL_SIZE]
+            self.wheel[self.tick % self.WHEEL_SIZE] = set()
+            if not slot:
+                continue
+            indexes = np.fromiter(slot, dtype=np.int64, count=len(slot))
+            ticks = (self.deadlines[indexes] // self.TICK_LENGTH).astype(np.int64)
+
+            # Entries for a later lap of the wheel stay where they are, and
+            # entries left behind by a reschedule are dropped
+            later = indexes[
+                (ticks > self.tick)
+                & (ticks % self.WHEEL_SIZE == self.tick % self.WHEEL_SIZE)
+            ]
+            self.wheel[self.tick % self.WHEEL_SIZE].update(later.tolist())
+            due = indexes[ticks <= self.tick]
+            if not len(due):
+                continue
+
+            result = self.produce_from(due)
+            rows += result.rows
+            items += result.items
+            self.deadlines[due] += np.maximum(
+                PRODUCTION_PERIOD * self.rates[due],
+                self.TICK_LENGTH,
+            )
+            for index in due.tolist():
+                self.schedule(index)
+        return ProductionResult(rows, items)
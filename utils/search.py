@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Iterable
+import functools
+
+from .animal_type import AnimalType
+
+__all__ = (
+    'ItemSearchIndex',
+    'ITEM_SEARCH',
+)
+
+
+PREFIX_SCORE = 2.0  # Added when the query starts one of an animal's terms
+WORD_PREFIX_SCORE = 1.0  # Added when the query starts a word within a term
+
+
+def get_trigrams(text: str) -> frozenset[str]:
+    """
+    Get the trigrams of a piece of text, padded so that short text and the
+    start of words still produce some.
+    """
+
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class ItemSearchIndex:
+    """
+    A search index over the names of each animal and its product, built once
+    so that searching doesn't need to compare the query against every name.
+
+    Each animal is indexed under its name and both forms of its product
+    name. Queries that start any of those terms (or any word in them) are
+    found in a prefix table, which is a trie flattened into a dict of every
+    prefix. Queries that don't are ranked by how many trigrams they share
+    with each term.
+
+    Attributes
+    ----------
+    terms : dict[AnimalType, tuple[str, ...]]
+        The lowercase terms that each animal is indexed under.
+    prefixes : dict[str, dict[AnimalType, float]]
+        The best prefix score of each animal for every prefix of its terms.
+    trigrams : dict[str, set[tuple[AnimalType, str]]]
+        The animals and terms that contain each trigram.
+    sizes : dict[str, int]
+        The number of trigrams in each term.
+    """
+
+    __slots__ = ("terms", "prefixes", "trigrams", "sizes", "search",)
+
+    def __init__(self, animals: Iterable[AnimalType]):
+        self.terms: dict[AnimalType, tuple[str, ...]] = {}
+        self.prefixes: dict[str, dict[AnimalType, float]] = defaultdict(dict)
+        self.trigrams: dict[str, set[tuple[AnimalType, str]]] = defaultdict(set)
+        self.sizes: dict[str, int] = {}
+        for animal in animals:
+            terms = tuple(dict.fromkeys(
+                t.lower()
+                for t in (animal.value.name, *animal.value.product)
+            ))
+            self.terms[animal] = terms
+            for term in terms:
+                self.add_prefixes(animal, term, PREFIX_SCORE)
+                for word in term.split()[1:]:
+                    self.add_prefixes(animal, word, WORD_PREFIX_SCORE)
+                trigrams = get_trigrams(term)
+                self.sizes[term] = len(trigrams)
+                for trigram in trigrams:
+                    self.trigrams[trigram].add((animal, term))
+        self.prefixes = dict(self.prefixes)
+        self.trigrams = dict(self.trigrams)
+
+        # Autocomplete sends the same few queries over and over while a user
+        # is typing, so the scores for each are kept
+        self.search = functools.lru_cache(maxsize=1_024)(self.score)
+
+    def add_prefixes(self, animal: AnimalType, text: str, score: float) -> None:
+        """
+        Add every prefix of some text to the prefix table.
+        """
+
+        for i in range(1, len(text) + 1):
+            scores = self.prefixes[text[:i]]
+            scores[animal] = max(scores.get(animal, 0.0), score)
+
+    def score(self, query: str) -> dict[AnimalType, float]:
+        """
+        Score how well each animal matches a query. Animals that don't match
+        at all are left out. Use :attr:`search` rather than this to have the
+        results cached.
+        """
+
+        query = " ".join(query.lower().split())
+        if not query:
+            return {}
+
+        # Score by the fraction of trigrams shared with the best term
+        query_trigrams = get_trigrams(query)
+        shared: dict[tuple[AnimalType, str], int] = defaultdict(int)
+        for trigram in query_trigrams:
+            for key in self.trigrams.get(trigram, ()):
+                shared[key] += 1
+        scores: dict[AnimalType, float] = {}
+        for (animal, term), count in shared.items():
+            similarity = count / (len(query_trigrams) + self.sizes[term] - count)
+            if similarity > scores.get(animal, 0.0):
+                scores[animal] = similarity
+
+        # Anything that the query is the start of beats any trigram match
+        for animal, score in self.prefixes.get(query, {}).items():
+            scores[animal] = scores.get(animal, 0.0) + score
+        return scores
+
+
+ITEM_SEARCH = ItemSearchIndex(AnimalType)
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+from typing_extensions import Self
+
+from .animal import Animal
+from .inventory import PlotItems
+from .plot import Plot, PlotWithAnimals
+from .statement import STATEMENTS
+
+if TYPE_CHECKING:
+    from uuid import UUID
+
+    import asyncpg
+
+__all__ = (
+    'PlotSnapshot',
+)
+
+FETCH_PLOT_SNAPSHOT = STATEMENTS.register(
+    "fetch_plot_snapshot",
+    """
+    SELECT
+        plots.*,
+        ARRAY(
+            SELECT
+                animals
+            FROM
+                animals
+            WHERE
+                animals.plot_id = plots.id
+        ) AS animals,
+        ARRAY(
+            SELECT
+                plot_items
+            FROM
+                plot_items
+            WHERE
+                plot_items.plot_id = plots.id
+        ) AS items
+    FROM
+        plots
+    WHERE
+        id = $1
+    """,
+)
+
+
+class PlotSnapshot:
+    """
+    A plot along with its animals and items, all loaded in a single query.
+
+    Attributes
+    ----------
+    plot : PlotWithAnimals
+        The plot and its animals.
+    items : PlotItems
+        The items in the plot.
+    version : int
+        The plot's version at the time the snapshot was taken.
+    """
+
+    def __init__(self, plot: PlotWithAnimals, items: PlotItems, version: int):
+        self.plot = plot
+        self.items = items
+        self.version = version
+
+    @classmethod
+    def from_row(cls, row: dict) -> Self:
+        """
+        Create a snapshot from a row with ``animals`` and ``items`` arrays.
+        """
+
+        plot = PlotWithAnimals.from_plot(
+            Plot.from_row(row),
+            animals=[Animal.from_row(i) for i in row["animals"]],
+        )
+        items = (
+            PlotItems.from_rows(row["items"])
+            if row["items"]
+            else PlotItems(plot.id)
+        )
+        return cls(plot, items, row["version"])
+
+    @classmethod
+    async def fetch(
+            cls,
+            conn: asyncpg.Connection,
+            plot_id: UUID) -> Self | None:
+        """
+        Get a plot, its animals and its items. The animals and items are
+        aggregated into arrays of rows by the database so that it's only one
+        round trip.
+
+        Unlike :meth:`PlotItems.fetch` this doesn't settle the plot, so
+        :func:`settle_plot` should be called first.
+        """
+
+        row = await FETCH_PLOT_SNAPSHOT.fetchrow(
+            conn,
+            plot_id,
+        )
+        if row is None:
+            return None
+        return cls.from_row(row)
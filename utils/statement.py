@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+from typing import Any
+import contextlib
+import time
+import weakref
+
+import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
+
+__all__ = (
+    'Statement',
+    'StatementCatalog',
+    'STATEMENTS',
+    'MAINTENANCE_STATEMENTS',
+)
+
+
+class Statement:
+    """
+    A named query in a :class:`StatementCatalog`, along with how often it's
+    been run and how long it's taken.
+
+    Attributes
+    ----------
+    name : str
+        The name of the statement.
+    query : str
+        The SQL for the statement.
+    calls : int
+        The number of times the statement has been run.
+    total_time : float
+        The total number of seconds that running the statement has taken.
+    """
+
+    def __init__(self, catalog: StatementCatalog, name: str, query: str):
+        self.catalog = catalog
+        self.name = name
+        self.query = query
+        self.calls: int = 0
+        self.total_time: float = 0.0
+
+    def __repr__(self) -> str:
+        return f"<Statement name={self.name!r} calls={self.calls}>"
+
+    async def run(self, conn: asyncpg.Connection, method: str, *args) -> Any:
+        """
+        Run the statement's prepared statement on the given connection,
+        preparing it first if the connection hasn't got it yet.
+        """
+
+        prepared = await self.catalog.prepare(conn, self)
+        start = time.perf_counter()
+        try:
+            if method == "execute":
+                await prepared.fetch(*args)
+                return prepared.get_statusmsg()
+            return await getattr(prepared, method)(*args)
+        finally:
+            self.calls += 1
+            self.total_time += time.perf_counter() - start
+
+    async def fetch(self, conn: asyncpg.Connection, *args) -> list[asyncpg.Record]:
+        return await self.run(conn, "fetch", *args)
+
+    async def fetchrow(self, conn: asyncpg.Connection, *args) -> asyncpg.Record | None:
+        return await self.run(conn, "fetchrow", *args)
+
+    async def fetchval(self, conn: asyncpg.Connection, *args) -> Any:
+        return await self.run(conn, "fetchval", *args)
+
+    async def execute(self, conn: asyncpg.Connection, *args) -> str:
+        return await self.run(conn, "execute", *args)
+
+
+class StatementCatalog:
+    """
+    A set of named queries, each prepared once per connection and kept as
+    a ``PreparedStatement``, so that nothing relies on asyncpg's implicit
+    statement cache or its size limit.
+
+    :data:`STATEMENTS` holds every query on the interaction path, and is
+    prepared on each of the bot's connections as it's opened, so parsing
+    and planning never happens while a user is waiting.
+    :data:`MAINTENANCE_STATEMENTS` holds the queries that only the
+    production leader runs, which are prepared one at a time on whichever
+    connections use them.
+
+    Attributes
+    ----------
+    statements : dict[str, Statement]
+        The statements in the catalog.
+    prepared : weakref.WeakKeyDictionary[asyncpg.Connection, dict[str, asyncpg.prepared_stmt.PreparedStatement]]
+        The prepared statements on each connection, by name.
+    """
+
+    def __init__(self):
+        self.statements: dict[str, Statement] = {}
+        self.prepared: weakref.WeakKeyDictionary[
+            asyncpg.Connection,
+            dict[str, PreparedStatement],
+        ] = weakref.WeakKeyDictionary()
+
+    def __getitem__(self, name: str) -> Statement:
+        return self.statements[name]
+
+    def __iter__(self):
+        return iter(self.statements.values())
+
+    def __len__(self) -> int:
+        return len(self.statements)
+
+    def register(self, name: str, query: str) -> Statement:
+        """
+        Add a statement to the catalog. Any connections that have already
+        been set up will have the statement prepared the first time they
+        run it.
+        """
+
+        if name in self.statements:
+            raise ValueError(f"Statement {name!r} is already registered")
+        statement = Statement(self, name, query)
+        self.statements[name] = statement
+        return statement
+
+    async def prepare(
+            self,
+            conn: asyncpg.Connection,
+            statement: Statement) -> PreparedStatement:
+        """
+        Get a statement's prepared statement on a connection, preparing it
+        if it hasn't been already.
+        """
+
+        # Pooled connections are handed out behind a new proxy each time,
+        # which can't be weakly referenced, so statements are kept against
+        # the connection underneath
+        raw = getattr(conn, "_con", conn)
+        prepared = self.prepared.setdefault(raw, {})
+        current = prepared.get(statement.name)
+        if current is None:
+            current = prepared[statement.name] = await raw.prepare(statement.query)
+            return current
+
+        # asyncpg refuses to run a prepared statement once its connection
+        # has been back in the pool, though the statement is still prepared
+        # on the server, so it's bound again to the connection as it is now
+        try:
+            current.get_name()
+        except asyncpg.InterfaceError:
+            current = prepared[statement.name] = PreparedStatement(
+                raw,
+                current._query,
+                current._state,
+            )
+        return current
+
+    async def setup(self, conn: asyncpg.Connection) -> None:
+        """
+        Prepare every statement in the catalog on a connection that hasn't
+        got them yet. This can be passed as a pool's ``init`` function.
+        """
+
+        for statement in list(self.statements.values()):
+            await self.prepare(conn, statement)
+
+    async def install(self, pool: asyncpg.Pool) -> None:
+        """
+        Prepare the catalog on every connection that a pool has open, and
+        make :meth:`setup` the pool's ``init`` function so that each
+        connection it opens from now on is prepared before it's handed out.
+        Pools that already have an ``init`` function keep it, and their new
+        connections prepare each statement the first time they run it.
+        """
+
+        # asyncpg only takes this when the pool is made, which the database
+        # extension does without one
+        if pool._init is None:
+            pool._init = self.setup
+
+        # Holding every connection at once means that each one is set up
+        async with contextlib.AsyncExitStack() as stack:
+            for _ in range(pool.get_size()):
+                conn = await stack.enter_async_context(pool.acquire())
+                await self.setup(conn)
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        Get how many times each statement has been run, and how long it's
+        taken in total and on average in milliseconds.
+        """
+
+        return {
+            s.name: {
+                "calls": s.calls,
+                "total_ms": s.total_time * 1_000,
+                "mean_ms": (s.total_time * 1_000 / s.calls) if s.calls else 0.0,
+            }
+            for s in self.statements.values()
+        }
+
+
+STATEMENTS = StatementCatalog()
+MAINTENANCE_STATEMENTS = StatementCatalog()